@@ -0,0 +1,48 @@
+"""
+Compare throughput and memory of the reconstruction algorithms in
+ufot.algorithms on the sinograms of a Shepp-Logan phantom.
+
+    $ python benchmarks/algorithms.py --size 512 --slices 16 --iterations 10
+"""
+import argparse
+import numpy as np
+import tomopy
+from ufot import algorithms, config
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--slices', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--ncore', type=int, default=None)
+    parser.add_argument('--accelerated', action='store_true')
+    args = parser.parse_args()
+
+    params = config.Params(sections=('reconstruction', 'ir', 'sirt', 'sirtfbp'))
+    params = params.add_arguments(argparse.ArgumentParser()).parse_args([])
+    params.iteration_count = args.iterations
+    params.accelerated = args.accelerated
+
+    phantom = tomopy.shepp3d(size=args.size)[:args.slices]
+    theta = tomopy.angles(args.size)
+    data = tomopy.project(phantom, theta, pad=False)
+    center = args.size / 2.0
+
+    print('{:<10} {:>12} {:>12} {:>14} {:>14} {:>10}'.format('Algorithm', 'slices/s', 'time [s]', 'arrays [MB]',
+                                                               'RSS +[MB]', 'RMSE'))
+
+    for name in algorithms.BACKENDS:
+        params.reconstruction_algorithm = name
+        rec = algorithms.reconstruct(params, data, theta, center, dict(ncore=args.ncore))
+        slices, seconds, nbytes, increase = algorithms.STATS[name]
+        error = np.sqrt(np.mean((rec / max(rec.max(), 1e-6) - phantom / phantom.max()) ** 2))
+        increase = 'n/a' if increase is None else '{:.1f}'.format(increase / 2.0 ** 20)
+        print('{:<10} {:>12.2f} {:>12.3f} {:>14.1f} {:>14} {:>10.4f}'.format(name, slices / seconds, seconds,
+                                                                            nbytes / 2.0 ** 20, increase, error))
+
+    print('Peak RSS of the whole run: {:.1f} MB'.format(algorithms.peak_memory() / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
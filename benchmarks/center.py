@@ -0,0 +1,70 @@
+"""
+Compare accuracy and runtime of the center estimators in ufot.process on
+synthetic 0/180 deg projection pairs with a known, sub-pixel rotation center.
+
+    $ python benchmarks/center.py --width 2560 --height 2160
+"""
+import time
+import argparse
+import numpy as np
+from scipy import ndimage
+from ufot import process
+
+
+def make_pair(width, height, center, noise, rng):
+    """Return projections at 0 and 180 deg of random blobs rotating around *center*."""
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    first = np.ones((height, width), dtype=np.float32)
+
+    for i in range(20):
+        x, y = rng.uniform(0.3, 0.7) * width, rng.uniform(0.1, 0.9) * height
+        radius = rng.uniform(0.01, 0.05) * width
+        first -= 0.2 * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * radius ** 2))
+
+    # At 180 deg, x is mirrored at the center: last(x) = first(2 * center - x)
+    last = ndimage.shift(first[:, ::-1], (0, 2 * center - width + 1), order=3, mode='nearest')
+    first = first + rng.normal(0, noise, first.shape).astype(np.float32)
+    last = last + rng.normal(0, noise, last.shape).astype(np.float32)
+
+    return first, last
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=2560)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=0.01)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    estimators = [
+        ('guess_center (fftconvolve)', process.guess_center),
+        ('phase correlation', process.phase_correlation_center),
+        ('phase correlation, binned 4x', lambda a, b: process.phase_correlation_center(a, b, binning=4)),
+        ('phase correlation, profile', lambda a, b: process.phase_correlation_center(a, b, profile=True)),
+        ('phase correlation, central rows binned 2x',
+         lambda a, b: process.phase_correlation_center(a, b, rows=(args.height // 4, 3 * args.height // 4), binning=2)),
+    ]
+    errors = dict((name, []) for name, func in estimators)
+    times = dict((name, []) for name, func in estimators)
+
+    for run in range(args.runs):
+        center = args.width / 2.0 + rng.uniform(-50, 50)
+        first, last = make_pair(args.width, args.height, center, args.noise, rng)
+
+        for name, func in estimators:
+            start = time.time()
+            result = func(first, last)
+            times[name].append(time.time() - start)
+            errors[name].append(abs(result - center))
+
+    print('{:<45} {:>12} {:>12} {:>10}'.format('Estimator', 'mean error', 'max error', 'time [s]'))
+
+    for name, func in estimators:
+        print('{:<45} {:>12.3f} {:>12.3f} {:>10.3f}'.format(name, np.mean(errors[name]),
+                                                             np.max(errors[name]), np.mean(times[name])))
+
+
+if __name__ == '__main__':
+    main()
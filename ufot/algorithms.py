@@ -0,0 +1,310 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import tomopy
+import ufot.config as config
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+LOG = logging.getLogger(__name__)
+
+# Reconstruction backends by the name of --reconstruction-algorithm.
+BACKENDS = OrderedDict()
+
+# Iterations between checkpoints of iterative reconstructions.
+CHECKPOINT_INTERVAL = 10
+
+# Slices, seconds, bytes of input and output and the largest increase of
+# the resident memory during a call of each backend in this process, see
+# reconstruct().
+STATS = OrderedDict()
+
+# Seconds between two samples of the resident memory.
+MEMORY_INTERVAL = 0.01
+
+
+class Backend(object):
+    """
+    Reconstruction algorithm *name* running *func* with the options of the
+    config *sections* and the options *names*. *accelerated* tells whether
+    TomoPy has an accelerated implementation of it.
+    """
+
+    def __init__(self, name, sections, names, func, accelerated=False):
+        self.name = name
+        self.sections = sections
+        self.names = names
+        self.func = func
+        self.accelerated = accelerated
+
+
+def register(name, sections=(), names=(), accelerated=False):
+    """Decorator registering a reconstruction function as backend *name*."""
+    def decorator(func):
+        BACKENDS[name] = Backend(name, sections, names, func, accelerated)
+        return func
+
+    return decorator
+
+
+def iterative_options(params, backend):
+    """Return the tomopy.recon arguments of the accelerated implementation if requested."""
+    if params.accelerated and backend.accelerated:
+        return dict(accelerated=True)
+
+    return {}
+
+
+def options_text(params, backend):
+    """Return the values of the config options of *backend* as text."""
+    names = [name.replace('-', '_') for section in backend.sections for name in sorted(config.SECTIONS[section])]
+    names += list(backend.names)
+    return ', '.join('{}={}'.format(name, getattr(params, name, None)) for name in names)
+
+
+@register('gridrec', names=('filter', ))
+def gridrec(params, data, theta, center, options, **kwargs):
+    return tomopy.recon(data, theta, center=center, algorithm='gridrec', filter_name=params.filter, **options)
+
+
+@register('fbp', names=('filter', ))
+def fbp(params, data, theta, center, options, **kwargs):
+    return tomopy.recon(data, theta, center=center, algorithm='fbp', filter_name=params.filter, **options)
+
+
+def identity(params):
+    """
+    Return the text identifying the results of params.reconstruction_algorithm
+    with its options, except the ones of the 'ir' section shared by all
+    iterative backends.
+    """
+    backend = BACKENDS[params.reconstruction_algorithm]
+    names = [name.replace('-', '_') for section in backend.sections if section != 'ir'
+             for name in sorted(config.SECTIONS[section])]
+    names += list(backend.names)
+    return '{} ({})'.format(backend.name, ', '.join('{}={}'.format(name, getattr(params, name)) for name in names))
+
+
+def checkpoint_path(params, key):
+    return os.path.join(params.checkpoint_dir, key + '.npz')
+
+
+def load_checkpoint(params, key):
+    """Return the estimate, iterations, identity and residual of checkpoint *key* or None."""
+    if not params.checkpoint_dir or key is None or not os.path.exists(checkpoint_path(params, key)):
+        return None
+
+    with np.load(checkpoint_path(params, key)) as f:
+        return f['rec'], int(f['iterations']), str(f['identity']), float(f['residual'])
+
+
+def save_checkpoint(params, key, rec, iterations, identity, residual):
+    if not params.checkpoint_dir or key is None:
+        return
+
+    if not os.path.exists(params.checkpoint_dir):
+        os.makedirs(params.checkpoint_dir)
+
+    # np.savez appends .npz to names lacking it
+    tmp_name = os.path.join(params.checkpoint_dir, key + '.tmp.npz')
+    np.savez(tmp_name, rec=rec, iterations=iterations, identity=identity,
+             residual=np.nan if residual is None else residual)
+    os.rename(tmp_name, checkpoint_path(params, key))
+
+
+def residual(data, theta, center, rec, options):
+    """Return the norm of the projections of *rec* minus *data* relative to the one of *data*."""
+    projected = tomopy.project(rec, theta, center=center, pad=False, ncore=options.get('ncore'))
+    return float(np.linalg.norm(projected - data) / max(np.linalg.norm(data), 1e-12))
+
+
+def initial_guess(params, data, theta, center, options, algorithm, key, current):
+    """
+    Return the estimate iterations start from, the number of iterations
+    already done and the residual of the estimate as selected by
+    params.warm_start. *current* is the identity() of the running
+    reconstruction, a checkpoint of the same one is resumed.
+    """
+    checkpoint = load_checkpoint(params, key) if params.warm_start == 'last' else None
+
+    if checkpoint is not None:
+        rec, iterations, previous_identity, last_residual = checkpoint
+
+        if previous_identity == current:
+            LOG.info('Resuming after %s iterations', iterations)
+            return rec, iterations, None if np.isnan(last_residual) else last_residual
+
+        LOG.info('Starting from the last result of %s', previous_identity)
+    elif params.warm_start == 'gridrec':
+        rec = gridrec(params, data, theta, center, options).astype(np.float32)
+    else:
+        return None, 0, None
+
+    # MLEM needs a positive estimate.
+    return np.maximum(rec, 1e-6) if algorithm == 'mlem' else rec, 0, None
+
+
+def iterate(params, data, theta, center, options, algorithm, key=None, on_iterate=None):
+    """
+    Run params.iteration_count iterations of the TomoPy *algorithm*, 'sirt'
+    or 'mlem', starting from TomoPy's default or from params.warm_start. The
+    estimate of the chunk *key* is saved in params.checkpoint_dir every CHECKPOINT_INTERVAL
+    iterations and at the end. Iterating stops early once the relative
+    residual improves by less than params.tolerance. *on_iterate* is called
+    with the number of iterations done, the estimate and the residual after
+    each of them.
+    """
+    rec, done, last_residual = initial_guess(params, data, theta, center, options, algorithm, key,
+                                             identity(params))
+
+    if done >= params.iteration_count:
+        LOG.info('Checkpoint already has %s iterations, not iterating further', done)
+        return rec
+
+    # Only the TomoPy iterations take the accelerated keywords, not the
+    # gridrec warm start.
+    options = dict(options, **iterative_options(params, BACKENDS[algorithm]))
+    stepwise = params.tolerance or on_iterate is not None or (params.checkpoint_dir and key)
+
+    if not stepwise:
+        return tomopy.recon(data, theta, center=center, algorithm=algorithm, num_iter=params.iteration_count,
+                            init_recon=rec, **options)
+
+    for iteration in range(done + 1, params.iteration_count + 1):
+        # TomoPy updates init_recon in place.
+        rec = tomopy.recon(data, theta, center=center, algorithm=algorithm, num_iter=1,
+                           init_recon=None if rec is None else rec.copy(), **options)
+        current = residual(data, theta, center, rec, options) if params.tolerance else None
+        converged = current is not None and last_residual is not None and \
+            last_residual - current < params.tolerance * last_residual
+
+        if current is not None:
+            LOG.info('Iteration %s: residual %.6g', iteration, current)
+
+        if on_iterate is not None:
+            on_iterate(iteration, rec, current)
+
+        if converged or iteration % CHECKPOINT_INTERVAL == 0 or iteration == params.iteration_count:
+            save_checkpoint(params, key, rec, iteration, identity(params), current)
+
+        if converged:
+            LOG.info('Residual improved by less than %s, stopping after %s iterations', params.tolerance, iteration)
+            break
+
+        last_residual = current
+
+    return rec
+
+
+@register('mlem', ('ir', ), accelerated=True)
+def mlem(params, data, theta, center, options, key=None, on_iterate=None):
+    return iterate(params, data, theta, center, options, 'mlem', key=key, on_iterate=on_iterate)
+
+
+# TomoPy's SIRT has no relaxation factor and there is no SIRT-FBP, the
+# options of the UFO 'sirt' and 'sirtfbp' sections are not used.
+@register('sirt', ('ir', ), accelerated=True)
+def sirt(params, data, theta, center, options, key=None, on_iterate=None):
+    return iterate(params, data, theta, center, options, 'sirt', key=key, on_iterate=on_iterate)
+
+
+def peak_memory():
+    """Return the peak resident memory of this process in bytes, if known."""
+    if resource is None:
+        return 0
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def current_memory():
+    """Return the resident memory of this process in bytes or None if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class MemoryMonitor(object):
+    """
+    Context manager sampling the resident memory every MEMORY_INTERVAL
+    seconds in a background thread. *peak* is the largest increase over the
+    memory at the start, or None where the resident memory is unknown.
+    """
+
+    def __init__(self):
+        self.peak = None
+        self.start = None
+        self.stop = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        current = current_memory()
+
+        if current is not None:
+            self.peak = max(self.peak, current - self.start)
+
+    def _run(self):
+        while not self.stop.wait(MEMORY_INTERVAL):
+            self._sample()
+
+    def __enter__(self):
+        self.start = current_memory()
+
+        if self.start is not None:
+            self.peak = 0
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+        return self
+
+    def __exit__(self, *args):
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self._sample()
+
+
+def reconstruct(params, data, theta, center, options, key=None, on_iterate=None):
+    """
+    Reconstruct the sinograms *data* with the backend of
+    params.reconstruction_algorithm and log its throughput and by how much
+    it increased the resident memory.
+    *options* are passed on to TomoPy. Iterative backends checkpoint the
+    chunk *key* and call *on_iterate* as described in iterate().
+    """
+    name = str(params.reconstruction_algorithm)
+
+    if name not in BACKENDS:
+        raise ValueError("Reconstruction algorithm {} is not available with TomoPy, choose one of {}".
+                         format(name, ', '.join(BACKENDS)))
+
+    LOG.info('%s: %s', name, options_text(params, BACKENDS[name]))
+    start = time.time()
+
+    with MemoryMonitor() as memory:
+        rec = BACKENDS[name].func(params, data, theta, center, options, key=key, on_iterate=on_iterate)
+
+    elapsed = max(time.time() - start, 1e-9)
+
+    slices, seconds, nbytes, increase = STATS.get(name, (0, 0.0, 0, None))
+    if memory.peak is not None:
+        increase = memory.peak if increase is None else max(increase, memory.peak)
+    STATS[name] = (slices + rec.shape[0], seconds + elapsed, max(nbytes, data.nbytes + rec.nbytes), increase)
+
+    LOG.info('%s: %s slices in %.3f s (%.2f slices/s), %.1f MB in and out, %s',
+             name, rec.shape[0], elapsed, rec.shape[0] / elapsed, (data.nbytes + rec.nbytes) / 2.0 ** 20,
+             'resident memory unknown' if memory.peak is None else
+             'resident memory grew by up to {:.1f} MB'.format(memory.peak / 2.0 ** 20))
+
+    return rec
@@ -0,0 +1,185 @@
+import os
+import sys
+import copy
+import glob
+import json
+import logging
+import threading
+import multiprocessing
+from argparse import ArgumentParser
+import ufot.config as config
+import ufot.parallel as parallel
+
+LOG = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def expand(patterns):
+    """Return the absolute names of the files matching the glob *patterns*."""
+    result = []
+
+    for pattern in patterns:
+        for fname in sorted(glob.glob(os.path.expanduser(pattern))):
+            fname = os.path.abspath(fname)
+            if fname not in result:
+                result.append(fname)
+
+    return result
+
+
+def override_name(fname):
+    """Return the name of the optional per-file configuration of *fname*."""
+    return os.path.splitext(fname)[0] + '.conf'
+
+
+def job_params(params, fname):
+    """
+    Return a copy of *params* to reconstruct *fname* into a directory named
+    after it. Values found in the per-file configuration override *params*,
+    including flags it sets to False.
+    """
+    parser = ArgumentParser()
+    parser = config.Params(sections=config.TOMO_PARAMS).add_arguments(parser)
+    base = copy.copy(params)
+
+    # Only flags that are True appear in the overrides.
+    for name in config.flags_in_config(override_name(fname)):
+        setattr(base, name.replace('-', '_'), False)
+
+    overrides = config.config_to_list(config_name=override_name(fname))
+    result = parser.parse_known_args(overrides, namespace=base)[0]
+    result.input_file_path = fname
+    result.output_path = os.path.splitext(fname)[0] + os.sep
+
+    if not os.path.exists(result.output_path):
+        os.makedirs(result.output_path)
+
+    return result
+
+
+def _run_job(params):
+    """Reconstruct one job, the exit code tells the queue whether it failed."""
+    from ufot import reco
+
+    try:
+        reco.tomo(params)
+    except Exception as e:
+        LOG.error('%s: %s', params.input_file_path, str(e))
+        sys.exit(1)
+
+
+class JobQueue(object):
+    """
+    Reconstruction jobs, one per Data Exchange file, whose state is written
+    to the JSON file *path* after every change. Loading an existing file
+    resumes the batch: finished jobs are skipped while interrupted and failed
+    ones are run again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = []
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+
+            for job in self.jobs:
+                if job['state'] in (RUNNING, FAILED):
+                    job['state'] = PENDING
+
+    def add(self, fnames):
+        """Append a pending job for each of *fnames* not yet in the queue."""
+        with self.lock:
+            known = [job['file'] for job in self.jobs]
+            self.jobs += [dict(file=fname, state=PENDING) for fname in fnames if fname not in known]
+            self.save()
+
+    def save(self):
+        tmp_name = self.path + '.tmp'
+
+        with open(tmp_name, 'w') as f:
+            json.dump(self.jobs, f, indent=2)
+
+        os.rename(tmp_name, self.path)
+
+    def count(self, state):
+        return len([job for job in self.jobs if job['state'] == state])
+
+    def _take(self):
+        with self.lock:
+            for job in self.jobs:
+                if job['state'] == PENDING:
+                    job['state'] = RUNNING
+                    self.save()
+                    return job
+
+    def _finish(self, job, state):
+        with self.lock:
+            job['state'] = state
+            self.save()
+
+    def run(self, params, concurrency, on_change=None, cancel=None):
+        """
+        Run all pending jobs with *params* in at most *concurrency* processes
+        at once, so that reading one file overlaps with reconstructing
+        another. *on_change* is called with the job whose state changed.
+        Setting the *cancel* event stops starting new jobs.
+        """
+        on_change = on_change or (lambda job: None)
+
+        # Share the cores of the node between the running jobs.
+        if params.ncore is None:
+            params = copy.copy(params)
+            params.ncore = max(parallel.available_cores() // concurrency, 1)
+
+        def worker():
+            while cancel is None or not cancel.is_set():
+                job = self._take()
+
+                if job is None:
+                    return
+
+                on_change(job)
+                LOG.info('Reconstructing %s', job['file'])
+
+                try:
+                    process = multiprocessing.Process(target=_run_job, args=(job_params(params, job['file']), ))
+                    process.start()
+                    process.join()
+                    state = DONE if process.exitcode == 0 else FAILED
+                except Exception as e:
+                    LOG.error('%s: %s', job['file'], str(e))
+                    state = FAILED
+
+                self._finish(job, state)
+                on_change(job)
+                LOG.info('%s %s (%s/%s done)', job['file'], state, self.count(DONE), len(self.jobs))
+
+        threads = [threading.Thread(target=worker) for i in range(concurrency)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+
+def run(args):
+    """Add the files given on the command line to the queue and run it."""
+    job_queue = JobQueue(args.batch_queue)
+    job_queue.add(expand(args.batch_files or []))
+
+    if not job_queue.jobs:
+        raise RuntimeError("No Data Exchange files to reconstruct")
+
+    job_queue.run(args, args.concurrency)
+    failed = job_queue.count(FAILED)
+
+    if failed:
+        raise RuntimeError("{} of {} jobs failed, run again to retry them".format(failed, len(job_queue.jobs)))
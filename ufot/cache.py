@@ -0,0 +1,306 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+import h5py
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+
+def nbytes(value):
+    """Return the size of the array *value* or of the arrays in the tuple *value*."""
+    if isinstance(value, tuple):
+        return sum(nbytes(item) for item in value)
+
+    return 0 if value is None else value.nbytes
+
+
+def copy(value):
+    """Return a copy of the array or tuple of arrays *value*."""
+    if isinstance(value, tuple):
+        return tuple(copy(item) for item in value)
+
+    return None if value is None else value.copy()
+
+
+class LRUCache(object):
+    """
+    Thread-safe cache of NumPy arrays, or tuples of them, evicting the least recently used ones
+    once their total size exceeds *max_bytes*.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        """Store *value* unless it alone is larger than the budget."""
+        size = nbytes(value)
+
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= nbytes(self.items.pop(key))
+
+            self.items[key] = value
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= nbytes(self.items.popitem(last=False)[1])
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+
+class SinogramCache(object):
+    """
+    Pre-processed sinograms, or other arrays, keyed by a hash of their
+    inputs, held in an LRU cache of *max_bytes* and also stored as .npy files
+    when a directory is given, so that they survive between runs.
+    """
+
+    def __init__(self, max_bytes):
+        self.memory = LRUCache(max_bytes)
+
+    def get(self, key, directory=None):
+        value = self.memory.get(key)
+
+        if directory:
+            path = os.path.join(directory, key + '.npy')
+
+            if value is None and os.path.exists(path):
+                value = np.load(path)
+                self.memory.put(key, value)
+            elif value is not None and not os.path.exists(path):
+                self.put(key, value, directory)
+
+        return value
+
+    def put(self, key, value, directory=None):
+        self.memory.put(key, value)
+
+        if directory:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            # np.save appends .npy to names lacking it
+            tmp_name = os.path.join(directory, key + '.tmp.npy')
+            np.save(tmp_name, value)
+            os.rename(tmp_name, os.path.join(directory, key + '.npy'))
+
+
+class Prefetcher(object):
+    """
+    Background thread calling *load* on the *count* indices following the
+    last requested one in the direction of travel, skipping those for which
+    *cached* is True. A new request abandons the previous one. Indices are
+    kept within 0 and *length*.
+    """
+
+    def __init__(self, load, cached, length, count=8):
+        self.load = load
+        self.cached = cached
+        self.length = length
+        self.count = count
+        self.last = None
+        self.target = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, index):
+        """Prefetch around *index*, moving on from the previously requested one."""
+        direction = -1 if self.last is not None and index < self.last else 1
+        self.last = index
+
+        with self.condition:
+            self.target = (index, direction)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.target is None and not self.closed:
+                    self.condition.wait()
+
+                if self.closed:
+                    return
+
+                index, direction = self.target
+                self.target = None
+
+            for step in range(1, self.count + 1):
+                neighbour = index + direction * step
+
+                if neighbour < 0 or neighbour >= self.length or self.target is not None or self.closed:
+                    break
+
+                if not self.cached(neighbour):
+                    try:
+                        self.load(neighbour)
+                    except Exception as e:
+                        LOG.debug('Prefetching %s failed: %s', neighbour, str(e))
+                        break
+
+
+class ProjectionCache(object):
+    """
+    Projections of the Data Exchange file *fname*, read through one open
+    file handle and kept in an LRU cache of *max_bytes*. The first flat and
+    dark field are read once. Projections ahead of the requested one are
+    prefetched in the background.
+    """
+
+    def __init__(self, fname, max_bytes=512 * 2**20, prefetch=8):
+        self.file = h5py.File(fname, 'r')
+        self.data = self.file['/exchange/data']
+        self.flat = self._first('/exchange/data_white')
+        self.dark = self._first('/exchange/data_dark')
+        self.cache = LRUCache(max_bytes)
+        self.prefetcher = Prefetcher(self._read, self.cache.__contains__, len(self), count=prefetch)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def _first(self, name):
+        try:
+            return self.file[name][0]
+        except KeyError:
+            return None
+
+    def _read(self, index):
+        image = self.data[index]
+        self.cache.put(index, image)
+        return image
+
+    def get(self, index):
+        """Return projection *index* and prefetch the following ones."""
+        image = self.cache.get(index)
+
+        if image is None:
+            image = self._read(index)
+
+        self.prefetcher.request(index)
+        return image
+
+    def close(self):
+        self.prefetcher.close()
+        self.file.close()
+
+
+class SliceCache(object):
+    """
+    Images 0 to *length* - 1 returned by *read*, kept in an LRU cache of
+    *max_bytes* and prefetched ahead of the requested one. Given
+    *thumbnail_bytes*, a background thread also fills a stack of all images
+    subsampled to fit that many bytes, for showing while scrubbing.
+    """
+
+    def __init__(self, read, length, max_bytes=512 * 2**20, prefetch=8, thumbnail_bytes=None):
+        self.read = read
+        self.length = length
+        self.cache = LRUCache(max_bytes)
+        self.thumbnail_bytes = thumbnail_bytes
+        self.thumbnails = None
+        self.thumbnail_step = None
+        self.has_thumbnail = np.zeros(length, dtype=bool)
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.prefetcher = Prefetcher(self._read, self.cache.__contains__, length, count=prefetch)
+        self.thread = None
+
+        if thumbnail_bytes:
+            self.thread = threading.Thread(target=self._fill_thumbnails)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, index):
+        return index in self.cache
+
+    def _read(self, index):
+        image = self.read(index)
+        self.cache.put(index, image)
+        self._put_thumbnail(index, image)
+        return image
+
+    def _put_thumbnail(self, index, image):
+        if not self.thumbnail_bytes:
+            return
+
+        with self.lock:
+            if self.thumbnails is None:
+                step = int(np.ceil(np.sqrt(image.nbytes * self.length / float(self.thumbnail_bytes))))
+                self.thumbnail_step = max(step, 1)
+                shape = image[::self.thumbnail_step, ::self.thumbnail_step].shape
+                self.thumbnails = np.empty((self.length, ) + shape, dtype=image.dtype)
+
+            self.thumbnails[index] = image[::self.thumbnail_step, ::self.thumbnail_step]
+            self.has_thumbnail[index] = True
+
+    def _fill_thumbnails(self):
+        for index in range(self.length):
+            if self.closed.is_set():
+                return
+
+            if not self.has_thumbnail[index]:
+                try:
+                    self._put_thumbnail(index, self.read(index))
+                except Exception as e:
+                    LOG.debug('Thumbnail of %s failed: %s', index, str(e))
+
+    def get(self, index):
+        """Return image *index* and prefetch the following ones."""
+        image = self.cache.get(index)
+
+        if image is None:
+            image = self._read(index)
+
+        self.prefetcher.request(index)
+        return image
+
+    def thumbnail(self, index):
+        """Return the subsampled image *index* or None if it is not there yet."""
+        if self.has_thumbnail[index]:
+            return self.thumbnails[index]
+
+    def close(self):
+        self.closed.set()
+        self.prefetcher.close()
+
+        if self.thread is not None:
+            self.thread.join()
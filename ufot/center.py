@@ -0,0 +1,297 @@
+import os
+import copy
+import logging
+import h5py
+import numpy as np
+import tomopy
+import dxchange
+import ufot.algorithms as algorithms
+import ufot.parallel as parallel
+import ufot.process as process
+import ufot.readers as readers
+import ufot.reco as reco
+import ufot.util as util
+
+LOG = logging.getLogger(__name__)
+
+# Width of the binned sinogram searched before refining at full resolution.
+COARSE_WIDTH = 512
+
+# Projections wider than this are binned to estimate the center.
+PAIR_WIDTH = 1024
+
+
+def projections(fname, indices):
+    """
+    Return the projections *indices* of the Data Exchange file *fname*,
+    corrected with its first flat and dark field if present.
+    """
+    with h5py.File(fname, 'r') as f:
+        exchange = f['exchange']
+        result = [exchange['data'][index].astype(np.float32) for index in indices]
+        dark = exchange['data_dark'][0].astype(np.float32) if 'data_dark' in exchange else 0
+        flat = exchange['data_white'][0].astype(np.float32) if 'data_white' in exchange else None
+
+    if flat is None:
+        return result
+
+    flat = np.maximum(flat - dark, 1e-6)
+    return [(projection - dark) / flat for projection in result]
+
+
+def pair_indices(theta, count):
+    """Return up to *count* evenly spread index pairs of projections 180 deg apart."""
+    theta = np.asarray(theta)
+    tolerance = np.median(np.abs(np.diff(theta))) / 2 if len(theta) > 1 else 0
+    pairs = []
+
+    for i, angle in enumerate(theta):
+        j = int(np.argmin(np.abs(theta - angle - np.pi)))
+
+        if abs(theta[j] - angle - np.pi) <= tolerance:
+            pairs.append((i, j))
+
+    if not pairs:
+        return [(0, len(theta) - 1)]
+
+    return pairs[::max(len(pairs) // count, 1)][:count]
+
+
+def estimate(fname, num_pairs=1):
+    """
+    Return the center of *fname* estimated by phase correlation, averaged
+    over *num_pairs* pairs of projections 180 deg apart. Estimates outside
+    the detector fall back to process.guess_center.
+    """
+    width = util.describe(fname).shape('data')[2]
+    binning = max(width // PAIR_WIDTH, 1)
+    centers = []
+
+    for i, j in pair_indices(util.describe(fname).theta, num_pairs):
+        first, last = projections(fname, (i, j))
+        center = process.phase_correlation_center(first, last, binning=binning)
+
+        if not 0 <= center < width:
+            LOG.warn('Phase correlation of projections %s and %s failed, using cross-correlation', i, j)
+            center = process.guess_center(first, last)
+
+        centers.append(center)
+
+    return float(np.median(centers))
+
+
+def fit_axis(fname, num_pairs=1, band_height=128):
+    """
+    Return the center of *fname* at the middle row and its change per row,
+    fitted to bands of *band_height* rows of *num_pairs* projection pairs.
+    """
+    width = util.describe(fname).shape('data')[2]
+    binning = max(width // PAIR_WIDTH, 1)
+    fits = []
+
+    for i, j in pair_indices(util.describe(fname).theta, num_pairs):
+        fits.append(process.fit_axis(*projections(fname, (i, j)), band_height=band_height, binning=binning))
+
+    center, slope = np.median(fits, axis=0)
+    LOG.info('Fitted center %.2f with a slope of %.4f px per row (tilt %.3f deg)',
+             center, slope, np.rad2deg(np.arctan(slope)))
+
+    return float(center), float(slope)
+
+
+def candidates(center, half_range, step):
+    """Return the centers from *center* - *half_range* to *center* + *half_range*."""
+    return center + np.arange(-half_range, half_range + step / 2.0, step)
+
+
+def sharpness(image):
+    """Gradient energy of *image*, larger for better focused slices."""
+    gy, gx = np.gradient(image.astype(np.float32))
+    return float(np.mean(gx ** 2 + gy ** 2))
+
+
+def entropy(image, bounds):
+    """Entropy of the histogram of *image* within *bounds*, smaller for better slices."""
+    hist, edges = np.histogram(image, bins=64, range=bounds)
+    hist = hist[hist > 0] / float(image.size)
+    return float(-np.sum(hist * np.log2(hist)))
+
+
+def golden_section(func, low, high, tolerance):
+    """Return the minimum of the unimodal *func* within *low* and *high*."""
+    ratio = (np.sqrt(5) - 1) / 2
+    a = high - ratio * (high - low)
+    b = low + ratio * (high - low)
+    fa, fb = func(a), func(b)
+
+    while high - low > tolerance:
+        if fa < fb:
+            high, b, fb = b, a, fa
+            a = high - ratio * (high - low)
+            fa = func(a)
+        else:
+            low, a, fa = a, b, fb
+            b = low + ratio * (high - low)
+            fb = func(b)
+
+    return (low + high) / 2.0
+
+
+def _search(params, sinogram, theta, center, half_range, tolerance, metric, cancel=None):
+    """
+    Search the center within *half_range* pixels of *center* minimizing
+    *metric* of a gridrec slice of the single-slice *sinogram*.
+    """
+    def reconstruct(c):
+        reco.check_cancelled(cancel)
+        rec = tomopy.recon(sinogram, theta, center=c, algorithm='gridrec',
+                           **parallel.options(params, 'recon', sinogram.shape))
+        return tomopy.circ_mask(rec, axis=0, ratio=0.95, **parallel.options(params, 'circ_mask', rec.shape))[0]
+
+    if metric == 'entropy':
+        # The histogram range must be the same for all candidates.
+        reference = reconstruct(center)
+        bounds = tuple(np.percentile(reference, (0.5, 99.5)))
+        objective = lambda c: entropy(reconstruct(c), bounds)
+    else:
+        objective = lambda c: -sharpness(reconstruct(c))
+
+    result = golden_section(objective, center - half_range, center + half_range, tolerance)
+    LOG.info('Center %.3f on %s sinogram', result, sinogram.shape)
+    return result
+
+
+def middle_row_center(params, center):
+    """
+    Return the center at the middle detector row of the rotation axis that
+    passes *center* at slice params.slice_start, following
+    params.center_slope.
+    """
+    if not params.center_slope:
+        return center
+
+    middle = util.describe(str(params.input_file_path)).shape('data')[1] / 2.0
+    return center - params.center_slope * (params.slice_start - middle)
+
+
+def refine(params, center=None, progress=None, cancel=None):
+    """
+    Return the center of slice params.slice_start to within
+    params.center_tolerance pixels. The center is first searched within
+    params.center_range pixels of *center*, given by estimate() by default,
+    on a binned sinogram of at most
+    COARSE_WIDTH pixels and then refined on the full resolution one. With
+    params.center_slope, the center at the middle row is returned as
+    --center expects it.
+    """
+    fname = str(params.input_file_path)
+
+    if center is None:
+        center = estimate(fname, params.center_pairs)
+        LOG.info('Estimated center: %s', center)
+
+    # Search the unbinned data, the coarse step bins by itself.
+    params = copy.copy(params)
+    params.binning = '0'
+    report = reco.reporter(progress, 0, 2)
+    reader = readers.open_reader(params, fname)
+    sinogram = reco.preprocessed(params, reader, params.slice_start, params.slice_start + 1, report)
+    theta = util.describe(fname).theta
+
+    width = sinogram.shape[2]
+    level = int(max(np.ceil(np.log2(width / float(COARSE_WIDTH))), 0))
+    scale = 2 ** level
+
+    report('recon')
+    coarse = tomopy.downsample(sinogram[::scale], level=level)
+    center = scale * _search(params, coarse, theta[::scale], center / scale, params.center_range / scale,
+                             0.5, params.center_metric, cancel)
+
+    reco.reporter(progress, 1, 2)('recon')
+    center = _search(params, sinogram, theta, center, scale, params.center_tolerance, params.center_metric, cancel)
+    LOG.info('Refined center: %.3f', center)
+
+    if params.center_slope:
+        center = middle_row_center(params, center)
+        LOG.info('Center at the middle row: %.3f', center)
+
+    return center
+
+
+def best_index(params, sharpnesses, entropies):
+    """Return the index of the best slice by params.center_metric."""
+    if params.center_metric == 'entropy':
+        return int(np.argmin(entropies))
+
+    return int(np.argmax(sharpnesses))
+
+
+def sweep(params, center=None, progress=None, cancel=None):
+    """
+    Reconstruct slice params.slice_start at every center within
+    params.center_range pixels of *center* in steps of params.center_step.
+    *center* defaults to the one given by estimate().
+    The sinogram is read and pre-processed once, the candidates are
+    reconstructed a batch at a time with TomoPy's threads. Return the
+    centers, the slices and their sharpness and entropy, which are also
+    written to the center directory of the output path unless
+    params.dry_run is set. The centers are those of the slice, see
+    middle_row_center() for the one to pass as --center.
+    """
+    fname = str(params.input_file_path)
+
+    if center is None:
+        center = estimate(fname, params.center_pairs)
+        LOG.info('Estimated center: %s', center)
+
+    centers = candidates(center, params.center_range, params.center_step)
+    reader = readers.open_reader(params, fname)
+    report = reco.reporter(progress, 0, 1)
+    sinogram = reco.preprocessed(params, reader, params.slice_start, params.slice_start + 1, report)
+    theta = util.describe(fname).theta
+
+    # Centers of binned data are binned as well.
+    scale = np.power(2, float(params.binning))
+    batches = np.array_split(centers / scale, max(len(centers) // parallel.available_cores(), 1))
+    LOG.info('Sweeping %s centers from %s to %s in %s batches', len(centers), centers[0], centers[-1], len(batches))
+    slices = []
+
+    for index, batch in enumerate(batches):
+        reco.check_cancelled(cancel)
+        reco.reporter(progress, index, len(batches))('recon')
+        data = np.repeat(sinogram, len(batch), axis=1)
+        rec = algorithms.reconstruct(params, data, theta, batch, parallel.options(params, 'recon', data.shape))
+        slices.append(tomopy.circ_mask(rec, axis=0, ratio=0.95, **parallel.options(params, 'circ_mask', rec.shape)))
+
+    slices = np.concatenate(slices)
+
+    # The histogram range must be the same for all candidates, as in refine().
+    bounds = tuple(np.percentile(slices[int(np.argmin(np.abs(centers - center)))], (0.5, 99.5)))
+    sharpnesses = [sharpness(image) for image in slices]
+    entropies = [entropy(image, bounds) for image in slices]
+    best = best_index(params, sharpnesses, entropies)
+
+    for c, s, e in zip(centers, sharpnesses, entropies):
+        LOG.info('Center %.2f: sharpness %.4g, entropy %.4g', c, s, e)
+
+    LOG.info('Best slice by %s at center %.2f', params.center_metric, centers[best])
+
+    if (params.dry_run == False):
+        report('write')
+        write(params, centers, slices, sharpnesses, entropies)
+
+    return centers, slices, sharpnesses, entropies
+
+
+def write(params, centers, slices, sharpnesses, entropies):
+    """Write one TIF per center and a table of their sharpness and entropy."""
+    path = os.path.join(str(params.output_path), 'center')
+
+    for c, image in zip(centers, slices):
+        dxchange.write_tiff(image, fname=os.path.join(path, '{:.2f}'.format(c)), overwrite=True)
+
+    with open(os.path.join(path, 'sharpness.txt'), 'w') as f:
+        for c, s, e in zip(centers, sharpnesses, entropies):
+            f.write('{:.2f} {:.6g} {:.6g}\n'.format(c, s, e))
+
+    LOG.info('Center sweep saved: %s', path)
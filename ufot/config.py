@@ -38,7 +38,11 @@ SECTIONS['gui'] = {
     'pre-processing': {
         'default': False,
         'help': "Enable pre-proces correction",
-        'action': 'store_true'}}
+        'action': 'store_true'},
+    'cache-size': {
+        'type': util.positive_int,
+        'default': 512,
+        'help': "Memory budget in MB for caching images in each viewer"}}
  
 SECTIONS['file-io'] = {
     'projection-start': {
@@ -120,7 +124,19 @@ SECTIONS['file-io'] = {
         'type': str,
         'help': "Path to location or format-specified file path "
                 "for storing reconstructed slices",
-        'metavar': 'PATH'}}
+        'metavar': 'PATH'},
+    'output-format': {
+        'default': 'tiff',
+        'type': str,
+        'help': "Format of the reconstructed volume: a stack of TIFs, a single "
+                "HDF5 file (reco.h5) or a chunked directory store readable by zarr "
+                "(reco.zarr) that workers can write in parallel",
+        'choices': ['tiff', 'hdf5', 'zarr']},
+    'output-compression': {
+        'default': 'none',
+        'type': str,
+        'help': "Compression of HDF5 and zarr output",
+        'choices': ['none', 'gzip']}}
 
 SECTIONS['flat-field-correction'] = {
     'flat-field': {
@@ -168,9 +184,11 @@ SECTIONS['flat-field-correction'] = {
 SECTIONS['normalization'] = {
     'nan-and-inf': {
         'default': True,
+        'type': util.str2bool,
         'help': "Fix nan and inf"},
     'minus-log': {
         'default': True,
+        'type': util.str2bool,
         'help': 'Do minus log'}}
 
 SECTIONS['phase-retrieval'] = {
@@ -197,6 +215,7 @@ SECTIONS['phase-retrieval'] = {
         'help': "Regularization parameter"},
     'pad': {
         'default': True,
+        'type': util.str2bool,
         'help': "If True, extend the size of the sinogram by padding with zeros"}}
 
 SECTIONS['ring-removal'] = {
@@ -238,6 +257,16 @@ SECTIONS['reconstruction'] = {
         'default': 1024.0,
         'type': float,
         'help': "Rotation axis position"},
+    'center-slope': {
+        'default': 0.0,
+        'type': float,
+        'help': "Change of the rotation axis position per detector row, --center is the "
+                "position at the middle row"},
+    'fit-axis': {
+        'default': False,
+        'help': "Fit --center and --center-slope to the 0 and 180 deg projections before a "
+                "full reconstruction and when calibrating in the GUI",
+        'action': 'store_true'},
     'dry-run': {
         'default': False,
         'help': "Reconstruct without writing data",
@@ -264,35 +293,136 @@ SECTIONS['ir'] = {
     'iteration-count': {
         'default': 10,
         'type': util.positive_int,
-        'help': "Maximum number of iterations"}}
+        'help': "Maximum number of iterations"},
+    'accelerated': {
+        'default': False,
+        'help': "Use the accelerated TomoPy implementation of mlem and sirt",
+        'action': 'store_true'},
+    'warm-start': {
+        'default': 'none',
+        'type': str,
+        'help': "Initial guess of iterative reconstructions: TomoPy's default, the gridrec slices or "
+                "the last result in --checkpoint-dir, which is resumed if the algorithm and its "
+                "options are unchanged",
+        'choices': ['none', 'gridrec', 'last']},
+    'checkpoint-dir': {
+        'default': None,
+        'type': str,
+        'help': "Directory keeping the current estimate of each chunk of iterative reconstructions",
+        'metavar': 'PATH'},
+    'tolerance': {
+        'default': 0.0,
+        'type': float,
+        'help': "Stop iterating once the relative residual improves by less than this fraction, "
+                "0 runs all iterations"}}
 
 SECTIONS['sirt'] = {
     'relaxation-factor': {
         'default': 0.25,
         'type': float,
-        'help': "Relaxation factor"}}
+        'help': "Relaxation factor of UFO's SIRT, not used by TomoPy's SIRT"}}
 
 SECTIONS['sirtfbp'] = {
     'lambda': {
         'default': 0.1,
         'type': float,
-        'help': "lambda (sirtfbp)"},
+        'help': "lambda (sirtfbp, which TomoPy does not provide)"},
     'mu': {
         'default': 0.5,
         'type': float,
-        'help': "mu (sirtfbp)"}}
+        'help': "mu (sirtfbp, which TomoPy does not provide)"}}
 
 SECTIONS['processing'] = {
     'sino-pass': {
         'type': util.positive_int,
         'default': 16,
         'help': 'Number of sinograms to process per pass'},
+    'reader': {
+        'default': 'auto',
+        'type': str,
+        'help': "How sinograms are read, 'auto' picks memory-mapped or chunk-aligned reads from the file layout",
+        'choices': ['auto', 'dxchange']},
+    'sinogram-cache': {
+        'default': False,
+        'help': "Keep a sinogram-major copy of the projections next to the input file for repeated slice access, "
+                "full reconstructions of files chunked across many rows use it anyway",
+        'action': 'store_true'},
+    'cache-dir': {
+        'default': None,
+        'type': str,
+        'help': "Directory keeping pre-processed single-slice sinograms between runs",
+        'metavar': 'PATH'},
+    'stream': {
+        'default': False,
+        'help': "Overlap reading and writing of passes with the reconstruction",
+        'action': 'store_true'},
+    'workers': {
+        'type': util.positive_int,
+        'default': 0,
+        'help': "Number of worker processes sharing a full reconstruction, 0 to run in-process"},
+    'launcher': {
+        'default': 'local',
+        'type': str,
+        'help': "How workers are started, 'mpi' expects to be run under mpirun",
+        'choices': ['local', 'mpi']},
+    'retries': {
+        'type': util.positive_int,
+        'default': 2,
+        'help': "Number of times a failed chunk is retried by the workers"},
     'ncore': {
         'default': None,
-        'help': "Number of cores that will be assigned to jobs"},
+        'type': util.positive_int_or_auto,
+        'help': "Number of cores that will be assigned to jobs, 'auto' to "
+                "choose from the data shape and the available cores"},
     'nchunk': {
         'default': None,
-        'help': "Chunk size for each core"}}
+        'type': util.positive_int_or_auto,
+        'help': "Chunk size for each core, 'auto' to split the data evenly"}}
+
+SECTIONS['batch'] = {
+    'batch-files': {
+        'default': None,
+        'type': str,
+        'nargs': '+',
+        'help': "Data Exchange files or glob patterns to reconstruct, a FILE.conf next to "
+                "FILE.h5 overrides the configuration for that file",
+        'metavar': 'FILE'},
+    'batch-queue': {
+        'default': 'ufot-batch.json',
+        'type': str,
+        'help': "File keeping the state of the batch queue, rerun to resume",
+        'metavar': 'FILE'},
+    'concurrency': {
+        'type': util.positive_int,
+        'default': 2,
+        'help': "Number of files reconstructed at the same time"}}
+
+SECTIONS['center'] = {
+    'center-range': {
+        'default': 10.0,
+        'type': float,
+        'help': "Sweep centers up to this many pixels around the estimated one"},
+    'center-step': {
+        'default': 0.5,
+        'type': float,
+        'help': "Distance in pixels between two swept centers"},
+    'center-pairs': {
+        'default': 1,
+        'type': util.positive_int,
+        'help': "Number of projection pairs 180 deg apart averaged to estimate the center"},
+    'center-refine': {
+        'default': False,
+        'help': "Search the center within --center-range instead of sweeping it",
+        'action': 'store_true'},
+    'center-metric': {
+        'default': 'entropy',
+        'type': str,
+        'help': "Image quality metric minimized by the center search",
+        'choices': ['entropy', 'gradient']},
+    'center-tolerance': {
+        'default': 0.1,
+        'type': float,
+        'help': "Precision in pixels of the center search"}}
 
 TOMO_PARAMS = ('file-io', 'flat-field-correction', 'normalization', 'phase-retrieval', 'processing', 'ring-removal', 'reconstruction', 'ir', 'sirt', 'sirtfbp')
 
@@ -368,6 +498,20 @@ def config_to_list(config_name=NAME):
     return result
 
 
+def flags_in_config(config_name=NAME):
+    """
+    Return the names of the store_true options given in the config file
+    *config_name*, whether True or False.
+    """
+    config = configparser.ConfigParser()
+
+    if not config.read([config_name]):
+        return []
+
+    return [name for section in SECTIONS for name, opts in SECTIONS[section].items()
+            if opts.get('action', None) == 'store_true' and config.has_option(section, name)]
+
+
 class Params(object):
     def __init__(self, sections=()):
         self.sections = sections + ('general', )
@@ -0,0 +1,284 @@
+import os
+import copy
+import logging
+import multiprocessing
+from collections import deque
+import numpy as np
+import ufot.reco as reco
+import ufot.parallel as parallel
+import ufot.readers as readers
+import ufot.volumes as volumes
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+    """
+    Hand out *chunks* to workers, put failed chunks back for at most
+    *retries* further attempts and report the merged progress.
+    """
+
+    def __init__(self, chunks, retries):
+        self.todo = deque(chunks)
+        self.total = len(chunks)
+        self.done = set()
+        self.retries = retries
+        self.attempts = {}
+
+    @property
+    def complete(self):
+        return len(self.done) == self.total
+
+    def next(self):
+        """Return the next chunk to process or None if none is left."""
+        return self.todo.popleft() if self.todo else None
+
+    def finished(self, chunk, worker):
+        self.done.add(chunk)
+        LOG.info('Slices %s:%s reconstructed by worker %s (%s/%s)',
+                 chunk[0], chunk[1], worker, len(self.done), self.total)
+
+    def failed(self, chunk, worker, reason):
+        if chunk in self.done:
+            return
+
+        self.attempts[chunk] = self.attempts.get(chunk, 0) + 1
+
+        if self.attempts[chunk] > self.retries:
+            raise RuntimeError("Slices {}:{} failed {} times, last on worker {}: {}".
+                               format(chunk[0], chunk[1], self.attempts[chunk], worker, reason))
+
+        LOG.warn('Slices %s:%s failed on worker %s (%s), retrying', chunk[0], chunk[1], worker, reason)
+        self.todo.append(chunk)
+
+
+def run(params, fname, chunks, offset):
+    """
+    Reconstruct *chunks* of *fname* on several workers, each of them writing
+    its own slab of the output numbered relative to *offset*.
+    """
+    if params.output_format == 'hdf5' and (params.dry_run == False):
+        raise RuntimeError("Workers cannot write a single HDF5 file, use --output-format zarr")
+
+    # Workers read chunks out of order, so no rows are carried between them.
+    if params.reader != 'dxchange' and not params.sinogram_cache and \
+            readers.needs_sinogram_cache(fname, chunks[0][0], chunks[-1][1], int(params.sino_pass), False):
+        params = copy.copy(params)
+        params.sinogram_cache = True
+
+    if params.launcher == 'mpi':
+        run_mpi(params, fname, chunks, offset)
+    else:
+        # Workers must not build a shared sinogram cache concurrently.
+        readers.open_reader(params, fname).prepare()
+        prepare_output(params, chunks, offset)
+        run_local(params, fname, chunks, offset)
+
+
+def prepare_output(params, chunks, offset):
+    """Create the output volume of *chunks* before workers write to it."""
+    if (params.dry_run == False):
+        shape = reco.output_shape(params, offset, chunks[-1][1])
+        volumes.writer(params).prepare(shape, np.float32)
+
+
+def process_chunk(params, reader, chunk, offset):
+    """Run the reco.tomo pipeline on a single *chunk* and write the result."""
+    data = reco.read(reader, chunk[0], chunk[1], reco.phase_margin(params))
+    rec = reco.reconstruct(params, *data, start=chunk[0])
+
+    if (params.dry_run == False):
+        reco.write(params, rec, chunk[0] - offset)
+
+
+def _work(params, fname, offset, tasks, results):
+    """Local worker loop processing the chunks sent through *tasks*."""
+    pid = os.getpid()
+    reader = readers.open_reader(params, fname)
+
+    while True:
+        chunk = tasks.get()
+
+        if chunk is None:
+            return
+
+        try:
+            process_chunk(params, reader, chunk, offset)
+            results.put(('done', pid, chunk, None))
+        except Exception as e:
+            results.put(('failed', pid, chunk, str(e)))
+
+
+class _Worker(object):
+
+    def __init__(self, params, fname, offset, results):
+        self.tasks = multiprocessing.Queue()
+        self.chunk = None
+        self.process = multiprocessing.Process(target=_work,
+                                               args=(params, fname, offset, self.tasks, results))
+        self.process.daemon = True
+        self.process.start()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def assign(self, chunk):
+        self.chunk = chunk
+        self.tasks.put(chunk)
+
+
+def run_local(params, fname, chunks, offset):
+    """
+    Reconstruct *chunks* with params.workers local processes. Workers that
+    die are replaced and their chunk is scheduled again.
+    """
+    scheduler = Scheduler(chunks, params.retries)
+    num_workers = min(params.workers, len(chunks))
+
+    # Do not let every worker grab all cores of the node.
+    if params.ncore is None:
+        params = copy.copy(params)
+        params.ncore = max(parallel.available_cores() // num_workers, 1)
+
+    LOG.info('Reconstructing %s chunks with %s local workers', len(chunks), num_workers)
+    results = multiprocessing.Queue()
+    workers = [_Worker(params, fname, offset, results) for i in range(num_workers)]
+
+    try:
+        while not scheduler.complete:
+            workers = _replace_dead(workers, scheduler, params, fname, offset, results)
+
+            for worker in workers:
+                if worker.chunk is None:
+                    chunk = scheduler.next()
+                    if chunk is None:
+                        break
+                    worker.assign(chunk)
+
+            try:
+                kind, pid, chunk, reason = results.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            for worker in workers:
+                if worker.pid == pid:
+                    worker.chunk = None
+
+            if kind == 'done':
+                scheduler.finished(chunk, pid)
+            else:
+                scheduler.failed(chunk, pid, reason)
+    finally:
+        for worker in workers:
+            if worker.process.is_alive():
+                worker.tasks.put(None)
+
+        for worker in workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+def _replace_dead(workers, scheduler, params, fname, offset, results):
+    """Return *workers* with exited processes replaced by new ones."""
+    alive = []
+
+    for worker in workers:
+        if worker.process.exitcode is None:
+            alive.append(worker)
+            continue
+
+        reason = 'exit code {}'.format(worker.process.exitcode)
+
+        if worker.chunk is not None:
+            scheduler.failed(worker.chunk, worker.pid, reason)
+
+        LOG.warn('Worker %s died with %s, starting a new one', worker.pid, reason)
+        alive.append(_Worker(params, fname, offset, results))
+
+    return alive
+
+
+def run_mpi(params, fname, chunks, offset):
+    """
+    Reconstruct *chunks* across the ranks of an MPI job started with e.g.
+    ``mpirun -n 5 ufot rec --launcher mpi``. Rank 0 schedules, all other ranks
+    reconstruct.
+    """
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        raise RuntimeError("The mpi launcher requires mpi4py")
+
+    comm = MPI.COMM_WORLD
+
+    if comm.size < 2:
+        raise RuntimeError("The mpi launcher needs at least two ranks")
+
+    if comm.rank == 0:
+        readers.open_reader(params, fname).prepare()
+        prepare_output(params, chunks, offset)
+
+    comm.Barrier()
+
+    if comm.rank == 0:
+        _coordinate_mpi(comm, MPI, params, chunks)
+    else:
+        _work_mpi(comm, params, fname, offset)
+
+
+def _coordinate_mpi(comm, MPI, params, chunks):
+    scheduler = Scheduler(chunks, params.retries)
+    busy = {}
+    LOG.info('Reconstructing %s chunks with %s MPI workers', len(chunks), comm.size - 1)
+
+    try:
+        for rank in range(1, comm.size):
+            chunk = scheduler.next()
+            if chunk is None:
+                break
+            busy[rank] = chunk
+            comm.send(chunk, dest=rank)
+
+        while not scheduler.complete:
+            status = MPI.Status()
+            kind, chunk, reason = comm.recv(source=MPI.ANY_SOURCE, status=status)
+            rank = status.Get_source()
+            del busy[rank]
+
+            if kind == 'done':
+                scheduler.finished(chunk, rank)
+            else:
+                scheduler.failed(chunk, rank, reason)
+
+            for idle in [rank] + [r for r in range(1, comm.size) if r not in busy and r != rank]:
+                chunk = scheduler.next()
+                if chunk is None:
+                    break
+                busy[idle] = chunk
+                comm.send(chunk, dest=idle)
+    finally:
+        for rank in range(1, comm.size):
+            comm.send(None, dest=rank)
+
+
+def _work_mpi(comm, params, fname, offset):
+    reader = readers.open_reader(params, fname)
+
+    while True:
+        chunk = comm.recv(source=0)
+
+        if chunk is None:
+            return
+
+        try:
+            process_chunk(params, reader, chunk, offset)
+            comm.send(('done', chunk, None), dest=0)
+        except Exception as e:
+            comm.send(('failed', chunk, str(e)), dest=0)
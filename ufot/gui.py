@@ -1,14 +1,20 @@
 import os
 import sys
+import copy
 import logging
+import threading
 import pkg_resources
 import tifffile
 import dxchange as dx
 import ufot.widgets
+import ufot.cache
 import ufot.process
+import ufot.volumes
 import ufot.util as util
 import ufot.config as config
 import ufot.reco as reco
+import ufot.batch as batch
+import ufot.center as center
 
 from argparse import ArgumentParser
 import numpy as np
@@ -21,10 +27,11 @@ LOG = logging.getLogger(__name__)
 
 
 def set_gui_startup(self, path):
-        data_size = util.get_dx_dims(str(path), 'data')
-        data_dark_size = util.get_dx_dims(str(path), 'data_dark')
-        data_white_size = util.get_dx_dims(str(path), 'data_white')
-        theta_size = util.get_dx_dims(str(path), 'theta')
+        descriptor = util.describe(path)
+        data_size = descriptor.shape('data')
+        data_dark_size = descriptor.shape('data_dark')
+        data_white_size = descriptor.shape('data_white')
+        theta_size = descriptor.shape('theta')
 
         self.ui.data_size.setText(str(data_size))
         self.ui.data_dark_size.setText(str(data_dark_size))
@@ -35,9 +42,7 @@ def set_gui_startup(self, path):
         self.ui.input_path_line.setText(path)
         self.input_file_path = os.path.dirname(str(path))
 
-        fname = str(self.ui.dx_file_name_line.text())
-
-        proj, flat, dark, theta = dx.read_aps_32id(fname, proj=(0, 1))
+        theta = descriptor.theta
         self.ui.theta_step.setText(str(np.rad2deg((theta[1] - theta[0]))))
         self.params.theta_start = theta[0]
         self.params.theta_end = theta[-1]
@@ -129,6 +134,121 @@ def set_output_path(path, line_edit, input_file_path):
     line_edit.setText(output_path)
     return output_path
 
+class LogRelay(QtCore.QObject):
+    """Forward formatted log records from any thread to the GUI thread."""
+    message = QtCore.pyqtSignal(str)
+
+class ReconstructionWorker(QtCore.QThread):
+    """
+    Run *func*, reco.tomo by default, on a snapshot of *params* outside the
+    GUI thread.
+
+    The *progress* signal carries the stage name, chunk index and number of
+    chunks, *done* the result of *func* and *cached* the pipeline stages of
+    a single slice reused from the cache. Volumes of full reconstructions
+    are passed to *done* if they fit into params.cache_size, otherwise None.
+    *iterated* carries the first slice of the chunk, the iteration and the
+    current estimate of iterative reconstructions.
+    """
+    progress = QtCore.pyqtSignal(str, int, int)
+    iterated = QtCore.pyqtSignal(int, int, object)
+    done = QtCore.pyqtSignal(object)
+    cached = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, params, func=None, parent=None):
+        super(ReconstructionWorker, self).__init__(parent)
+        self.params = copy.copy(params)
+        self.func = func or reco.tomo
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Stop the reconstruction before its next chunk."""
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            if self.func is reco.tomo and self.params.full_reconstruction:
+                rec = self.reconstruct_volume()
+            elif self.func is reco.tomo:
+                hits = []
+                rec = self.func(self.params, progress=self.progress.emit, cancel=self.cancel_event,
+                                on_iterate=self.iterated.emit, hits=hits)
+                self.cached.emit(hits)
+            else:
+                rec = self.func(self.params, progress=self.progress.emit, cancel=self.cancel_event)
+
+            self.done.emit(rec)
+        except reco.Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def reconstruct_volume(self):
+        start, end = reco.slice_range(self.params)
+        width = util.describe(str(self.params.input_file_path)).shape('data')[2] // 2 ** int(self.params.binning)
+        volume = None
+
+        if (end - start) * width ** 2 * 4 <= self.params.cache_size * 2**20:
+            volume = reco.Volume(start, end)
+        else:
+            LOG.info('Volume is larger than the cache size, it is only written')
+
+        reco.tomo(self.params, progress=self.progress.emit, cancel=self.cancel_event, result=volume,
+                  on_iterate=self.iterated.emit)
+        return volume.data if volume is not None else None
+
+
+class PreviewWorker(QtCore.QThread):
+    """
+    Run reco.preview on a snapshot of *params*, emitting *result* with the
+    binning and the slice of each level.
+    """
+    result = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, params, parent=None):
+        super(PreviewWorker, self).__init__(parent)
+        self.params = copy.copy(params)
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Stop before the next level."""
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            reco.preview(self.params, self.result.emit, cancel=self.cancel_event)
+        except reco.Cancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class QueueWorker(QtCore.QThread):
+    """Run the pending jobs of a batch.JobQueue outside the GUI thread."""
+    changed = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, job_queue, params, concurrency, parent=None):
+        super(QueueWorker, self).__init__(parent)
+        self.job_queue = job_queue
+        self.params = copy.copy(params)
+        self.concurrency = concurrency
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Do not start any further jobs."""
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            self.job_queue.run(self.params, self.concurrency,
+                               on_change=lambda job: self.changed.emit(), cancel=self.cancel_event)
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class CallableHandler(logging.Handler):
     def __init__(self, func):
         logging.Handler.__init__(self)
@@ -201,6 +321,7 @@ class ApplicationWindow(QtGui.QMainWindow):
         self.ui.projection_dock.setVisible(False)
         self.ui.slice_dock.setVisible(False)
         self.ui.volume_dock.setVisible(False)
+        self.ui.ortho_dock.setVisible(False)
         self.ui.center_view_widget.setVisible(False)
 
         self.get_values_from_params()
@@ -222,11 +343,23 @@ class ApplicationWindow(QtGui.QMainWindow):
         self.ui.theta_step_label.setVisible(False)
 
         self.center_calibration = None
+        self.reco_worker = None
+        self.cached_stages = []
+        self.sweep_centers = None
+        self.last_result = None
+        self.preview_worker = None
+        self.retired_preview_workers = []
+        self.preview_state = None
+        self.preview_timer = QtCore.QTimer()
+        self.preview_timer.setInterval(300)
+        self.job_queue = None
+        self.queue_worker = None
     
         # set up run-time widgets
-        self.projection_viewer = ufot.widgets.ProjectionViewer()
+        self.projection_viewer = ufot.widgets.ProjectionViewer(cache_size=self.params.cache_size * 2**20)
         self.slice_viewer = None
         self.volume_viewer = None
+        self.ortho_viewer = None
         self.overlap_viewer = ufot.widgets.OverlapViewer()
         #self.slice_viewer = ufot.widgets.SliceViewer()
         #self.volume_viewer = ufot.widgets.VolumeViewer()
@@ -237,6 +370,11 @@ class ApplicationWindow(QtGui.QMainWindow):
         self.ui.slice_dock.setWidget(self.slice_viewer)
         self.ui.volume_dock.setWidget(self.volume_viewer)
 
+        self.queue_viewer = ufot.widgets.QueueViewer()
+        self.queue_viewer.concurrency.setValue(self.params.concurrency)
+        self.ui.queue_dock.setWidget(self.queue_viewer)
+        self.ui.queue_dock.setVisible(False)
+
         # connect signals
         self.overlap_viewer.slider.valueChanged.connect(self.center_slider_changed)
         self.ui.slice_box.clicked.connect(self.on_slice_box_clicked)
@@ -250,6 +388,8 @@ class ApplicationWindow(QtGui.QMainWindow):
 
         self.ui.calibrate_dx.clicked.connect(self.on_calibrate_dx)
         self.ui.show_slices_button.clicked.connect(self.on_show_slices_clicked)
+        self.ui.show_volume_button.clicked.connect(self.on_show_volume_clicked)
+        self.ui.show_ortho_button.clicked.connect(self.on_show_ortho_clicked)
         self.ui.show_projection_button.clicked.connect(self.on_show_projection_clicked)
         self.ui.flat_field.clicked.connect(self.on_pre_processing_box_clicked)
         self.ui.flat_field_method.currentIndexChanged.connect(self.change_flat_field_method)
@@ -291,14 +431,28 @@ class ApplicationWindow(QtGui.QMainWindow):
 
         self.ui.center_spin.valueChanged.connect(self.change_center_spin)
         self.ui.reco_button.clicked.connect(self.on_reconstruct)
+        self.ui.sweep_button.clicked.connect(self.on_sweep)
+        self.ui.refine_button.clicked.connect(self.on_refine)
+        self.ui.preview_box.clicked.connect(self.on_preview_box_clicked)
+        self.preview_timer.timeout.connect(self.check_preview)
+        self.ui.sweep_range_spin.valueChanged.connect(lambda value: self.change_value('center_range', value))
+        self.ui.sweep_step_spin.valueChanged.connect(lambda value: self.change_value('center_step', value))
+        self.ui.cancel_button.clicked.connect(self.on_cancel_reconstruct)
+
+        self.ui.queue_action.triggered.connect(self.on_show_queue)
+        self.queue_viewer.add_button.clicked.connect(self.on_queue_add)
+        self.queue_viewer.start_button.clicked.connect(self.on_queue_start)
+        self.queue_viewer.stop_button.clicked.connect(self.on_queue_stop)
 
         self.ui.open_action.triggered.connect(self.on_open_from)
         self.ui.save_action.triggered.connect(self.on_save_as)
         self.ui.close_action.triggered.connect(self.close)
         self.ui.about_action.triggered.connect(self.on_about)
 
-        # set up log handler
-        log_handler = CallableHandler(self.output_log)
+        # set up log handler, records may come from the reconstruction thread
+        self.log_relay = LogRelay()
+        self.log_relay.message.connect(self.output_log)
+        log_handler = CallableHandler(self.log_relay.message.emit)
         log_handler.setLevel(logging.DEBUG)
         log_handler.setFormatter(logging.Formatter('%(name)s: %(message)s'))
         root_logger = logging.getLogger('')
@@ -322,29 +476,49 @@ class ApplicationWindow(QtGui.QMainWindow):
 
     def on_calibrate_dx(self):
         fname = str(self.ui.dx_file_name_line.text())
-        last_ind = util.get_dx_dims(str(fname), 'theta')
+        descriptor = util.describe(fname)
+        last_ind = descriptor.shape('theta')
         if (last_ind == None):
-            last_ind = util.get_dx_dims(str(fname), 'data')
-    
-        proj, flat, dark, theta = dx.read_aps_32id(fname, proj=(0, 1))
-        ##self.ui.theta_step.setText(str((180.0 / np.pi * theta[1] - theta[0]).astype(np.float)))
+            last_ind = descriptor.shape('data')
 
-        if self.params.flat_field:
-            first = proj[0,:,:].astype(np.float)/flat[0,:,:].astype(np.float)
-        else:
-            first = proj[0,:,:].astype(np.float)
-        proj, flat, dark, theta = dx.read_aps_32id(fname, proj=(last_ind[0]-1, last_ind[0]))
-        if self.params.flat_field:
-            last = proj[0,:,:].astype(np.float)/flat[0,:,:].astype(np.float)
+        # Share the open file and cached flat field of the projection viewer
+        # without changing what it shows.
+        if self.projection_viewer.filenames == fname:
+            projections = self.projection_viewer.projections
         else:
-            last = proj[0,:,:].astype(np.float)
+            projections = ufot.cache.ProjectionCache(fname, prefetch=0)
+        ##self.ui.theta_step.setText(str((180.0 / np.pi * theta[1] - theta[0]).astype(np.float)))
+
+        try:
+            first = projections.get(0).astype(np.float)
+            last = projections.get(last_ind[0]-1).astype(np.float)
+        finally:
+            if projections is not self.projection_viewer.projections:
+                projections.close()
+
+        if self.params.flat_field and projections.flat is not None:
+            first /= projections.flat.astype(np.float)
+            last /= projections.flat.astype(np.float)
 
         with spinning_cursor():
             self.center_calibration = ufot.process.CenterCalibration(first, last)
 
-        position = self.center_calibration.position
+            # The tilt is only used when asked for, it changes the meaning of
+            # the center, which must then come from the same fit.
+            if self.params.fit_axis:
+                middle_center, self.params.center_slope = ufot.process.fit_axis(first, last, binning=2)
+                self.center_calibration.center = middle_center
+                LOG.info('Rotation axis at %.2f px in the middle row, moving by %.4f px per row (tilt %.3f deg)',
+                         middle_center, self.params.center_slope,
+                         np.rad2deg(np.arctan(self.params.center_slope)))
+
+        # Moving the slider rounds the center to its position, keep the estimate.
+        estimate = self.center_calibration.center
         self.overlap_viewer.set_images(first, last)
-        self.overlap_viewer.set_position(position)
+        self.overlap_viewer.set_position(self.center_calibration.position)
+        self.center_calibration.center = estimate
+        self.ui.center.setText(str(estimate))
+        self.ui.center_spin.setValue(estimate)
 
     def center_slider_changed(self):
         val = self.overlap_viewer.slider.value()
@@ -354,16 +528,78 @@ class ApplicationWindow(QtGui.QMainWindow):
         self.ui.center_spin.setValue(self.center_calibration.center)
 
     def on_show_slices_clicked(self):
+        if self.last_result is not None:
+            self.show_slices(self.last_result)
+            return
+
+        volume = self.open_output_volume()
+
+        if volume is not None:
+            self.show_slices(volume)
+            return
+
         path = str(self.ui.output_path_line.text())
         filenames = get_filtered_filenames(path)
         LOG.warn("Loading {}".format(filenames))
+        self.sweep_centers = None
         if not self.slice_viewer:
             self.slice_viewer = ufot.widgets.SliceViewer(filenames)
+            self.slice_viewer.slider.valueChanged.connect(self.on_sweep_slice_changed)
             self.slice_dock.setWidget(self.slice_viewer)
             self.ui.slice_dock.setVisible(True)
         else:
             self.slice_viewer.load_files(filenames)
 
+    def open_output_volume(self):
+        """Return the HDF5 or zarr output as a lazily read volume or None for TIFs."""
+        if self.params.output_format == 'tiff':
+            return None
+
+        return ufot.volumes.open_volume(ufot.volumes.output_name(self.params))
+
+    def show_slices(self, images, labels=None):
+        """Show the in-memory stack *images* in the slice viewer."""
+        if not self.slice_viewer:
+            self.slice_viewer = ufot.widgets.SliceViewer([])
+            self.slice_viewer.slider.valueChanged.connect(self.on_sweep_slice_changed)
+            self.ui.slice_dock.setWidget(self.slice_viewer)
+
+        self.sweep_centers = None
+        self.slice_viewer.set_stack(images, labels)
+        self.ui.slice_dock.setVisible(True)
+
+    def on_show_volume_clicked(self):
+        if not self.volume_viewer:
+            self.volume_viewer = ufot.widgets.VolumeViewer()
+            self.ui.volume_dock.setWidget(self.volume_viewer)
+
+        volume = self.open_output_volume()
+
+        if self.last_result is not None and len(self.last_result) > 1:
+            self.volume_viewer.set_volume(self.last_result)
+        elif volume is not None:
+            self.volume_viewer.set_volume(volume)
+        else:
+            self.volume_viewer.load_data(get_filtered_filenames(str(self.ui.output_path_line.text())))
+
+        self.ui.volume_dock.setVisible(True)
+
+    def on_show_ortho_clicked(self):
+        if not self.ortho_viewer:
+            self.ortho_viewer = ufot.widgets.OrthoViewer(cache_size=self.params.cache_size * 2**20)
+            self.ui.ortho_dock.setWidget(self.ortho_viewer)
+
+        volume = self.open_output_volume()
+
+        if self.last_result is not None and len(self.last_result) > 1:
+            self.ortho_viewer.set_source(self.last_result)
+        elif volume is not None:
+            self.ortho_viewer.set_source(volume)
+        else:
+            self.ortho_viewer.set_source(get_filtered_filenames(str(self.ui.output_path_line.text())))
+
+        self.ui.ortho_dock.setVisible(True)
+
     def on_show_projection_clicked(self):
         path = str(self.ui.dx_file_name_line.text())
         self.ui.projection_dock.setVisible(True)
@@ -488,6 +724,8 @@ class ApplicationWindow(QtGui.QMainWindow):
         self.ui.slice_end.setValue(self.params.slice_end if self.params.slice_end else 2)
         self.ui.slice_center.setValue(self.params.slice_center if self.params.slice_center else 1)
         self.ui.center_spin.setValue(self.params.center if self.params.center else 0.0)
+        self.ui.sweep_range_spin.setValue(self.params.center_range)
+        self.ui.sweep_step_spin.setValue(self.params.center_step)
         self.ui.pixel_size.setValue(self.params.pixel_size if self.params.pixel_size else 1.0)
         self.ui.distance.setValue(self.params.propagation_distance if self.params.propagation_distance else 1.0)
         self.ui.energy.setValue(self.params.energy if self.params.energy else 10.0)
@@ -746,9 +984,24 @@ class ApplicationWindow(QtGui.QMainWindow):
             self.params.center = self.ui.center_spin.value()
 
     def closeEvent(self, event):
+        self.preview_timer.stop()
+
+        for worker in [self.preview_worker] + self.retired_preview_workers:
+            if worker is not None and worker.isRunning():
+                worker.cancel()
+                worker.wait()
+
+        if self.reco_worker is not None and self.reco_worker.isRunning():
+            self.reco_worker.cancel()
+            self.reco_worker.wait()
+
+        if self.queue_worker is not None and self.queue_worker.isRunning():
+            self.queue_worker.cancel()
+            self.queue_worker.wait()
+
         try:
             self.params.flat_field_method = 'default'
-            sections = config.TOMO_PARAMS + ('gui', 'retrieve-phase')
+            sections = config.TOMO_PARAMS + ('gui', 'batch', 'center', 'retrieve-phase')
             config.write('ufot.conf', args=self.params, sections=sections)
             config.write(str(self.params.input_path)+'.conf', args=self.params, sections=sections)
         except IOError as e:
@@ -762,13 +1015,13 @@ class ApplicationWindow(QtGui.QMainWindow):
             config_file = str(os.getenv('HOME') + "ufot.conf")
         save_config = QtGui.QFileDialog.getSaveFileName(self, 'Save as ...', config_file)
         if save_config:
-            sections = config.TOMO_PARAMS + ('gui',)
+            sections = config.TOMO_PARAMS + ('gui', 'batch', 'center')
             config.write(save_config, args=self.params, sections=sections)
 
     def on_open_from(self):
         config_file = QtGui.QFileDialog.getOpenFileName(self, 'Open ...', self.params.input_file_path)
         parser = ArgumentParser()
-        params = config.Params(sections=config.TOMO_PARAMS + ('gui',))
+        params = config.Params(sections=config.TOMO_PARAMS + ('gui', 'batch', 'center'))
         parser = params.add_arguments(parser)
         self.params = parser.parse_known_args(config.config_to_list(config_name=config_file))[0]
         self.get_values_from_params()
@@ -816,31 +1069,182 @@ class ApplicationWindow(QtGui.QMainWindow):
         self.ui.theta_step_label.setVisible(self.ui.manual_box.isChecked())
         
     def on_reconstruct(self):
-        with spinning_cursor():
-            self.ui.centralWidget.setEnabled(False)
-            self.repaint()
-            self.app.processEvents()
-
-            input_images = check_filename(str(self.params.input_file_path))
-            if not input_images:
-                self.gui_warn("No data found in {}".format(str(self.ui.input_path_line.text())))
-                self.ui.centralWidget.setEnabled(True)
-                return
-
-            is_mlem = self.params.reconstruction_algorithm == 'mlem'
-            is_sirt = self.params.reconstruction_algorithm == 'sirt'
-            is_sirtfbp = self.params.reconstruction_algorithm == 'sirtfbp'
-            if (is_mlem or is_sirt or is_sirtfbp) :
-                self.params.iteration_count = self.ui.iteration_count.value()
-            
-            data_size = util.get_dx_dims(str(self.ui.input_path_line.text()), 'data')
-
-            try:
-                 reco.tomo(self.params)
-            except Exception as e:
-                self.gui_warn(str(e))
-
-            self.ui.centralWidget.setEnabled(True)
+        self.start_reconstruction(reco.tomo, self.on_reconstruct_done)
+
+    def on_reconstruct_done(self, rec):
+        self.last_result = rec
+
+        if rec is not None:
+            self.show_slices(rec)
+
+    def on_sweep(self):
+        self.start_reconstruction(center.sweep, self.on_sweep_done)
+
+    def on_refine(self):
+        self.start_reconstruction(center.refine, self.ui.center_spin.setValue)
+
+    def start_reconstruction(self, func, on_done=None):
+        """Run *func* in a ReconstructionWorker and pass its result to *on_done*."""
+        if self.reco_worker is not None and self.reco_worker.isRunning():
+            self.gui_warn("A reconstruction is already running")
+            return
+
+        input_images = check_filename(str(self.params.input_file_path))
+        if not input_images:
+            self.gui_warn("No data found in {}".format(str(self.ui.input_path_line.text())))
+            return
+
+        is_mlem = self.params.reconstruction_algorithm == 'mlem'
+        is_sirt = self.params.reconstruction_algorithm == 'sirt'
+        is_sirtfbp = self.params.reconstruction_algorithm == 'sirtfbp'
+        if (is_mlem or is_sirt or is_sirtfbp) :
+            self.params.iteration_count = self.ui.iterations.value()
+
+        self.reco_worker = ReconstructionWorker(self.params, func)
+        if on_done is not None:
+            self.reco_worker.done.connect(on_done)
+        self.reco_worker.progress.connect(self.on_reconstruct_progress)
+        self.reco_worker.iterated.connect(self.on_reconstruct_iterated)
+        self.reco_worker.cached.connect(self.on_reconstruct_cached)
+        self.reco_worker.failed.connect(self.gui_warn)
+        self.reco_worker.cancelled.connect(lambda: LOG.info('Reconstruction cancelled'))
+        self.reco_worker.finished.connect(self.on_reconstruct_finished)
+
+        self.cached_stages = []
+        self.ui.reco_progress.setValue(0)
+        self.ui.reco_button.setEnabled(False)
+        self.ui.sweep_button.setEnabled(False)
+        self.ui.refine_button.setEnabled(False)
+        self.ui.cancel_button.setEnabled(True)
+        self.reco_worker.start()
+
+    def on_reconstruct_iterated(self, chunk_start, iteration, rec):
+        """Show the estimate of the first chunk after each iteration."""
+        if chunk_start == reco.slice_range(self.params)[0]:
+            self.show_slices(rec, ['Iteration {}'.format(iteration)] * len(rec))
+
+    def on_reconstruct_progress(self, stage, index, total):
+        stage = str(stage)
+        num_stages = len(reco.STAGES)
+        self.ui.reco_progress.setRange(0, total * num_stages)
+        value = index * num_stages + reco.STAGES.index(stage)
+        self.ui.reco_progress.setValue(max(value, self.ui.reco_progress.value()))
+        self.ui.reco_progress.setFormat('{} ({}/{})'.format(stage, index + 1, total))
+
+    def on_reconstruct_cached(self, stages):
+        self.cached_stages = stages
+
+    def on_cancel_reconstruct(self):
+        if self.reco_worker is not None:
+            LOG.info('Cancelling reconstruction after the current chunk')
+            self.reco_worker.cancel()
+            self.ui.cancel_button.setEnabled(False)
+
+    def on_reconstruct_finished(self):
+        self.ui.reco_progress.setValue(self.ui.reco_progress.maximum())
+
+        if self.cached_stages:
+            self.ui.reco_progress.setFormat('%p% (cached: {})'.format(', '.join(self.cached_stages)))
+        else:
+            self.ui.reco_progress.setFormat('%p%')
+        self.ui.reco_button.setEnabled(True)
+        self.ui.sweep_button.setEnabled(True)
+        self.ui.refine_button.setEnabled(True)
+        self.ui.cancel_button.setEnabled(False)
+
+    def on_sweep_done(self, result):
+        centers, slices, sharpnesses, entropies = result
+        labels = ['Center {:.2f} px, sharpness {:.4g}, entropy {:.4g}'.format(c, s, e)
+                  for c, s, e in zip(centers, sharpnesses, entropies)]
+
+        self.show_slices(slices, labels)
+        self.sweep_centers = centers
+        self.slice_viewer.slider.setValue(center.best_index(self.params, sharpnesses, entropies))
+
+    def on_sweep_slice_changed(self, index):
+        """Use the center of the swept slice on display."""
+        if self.sweep_centers is not None:
+            self.ui.center_spin.setValue(center.middle_row_center(self.params, self.sweep_centers[index]))
+
+    def on_preview_box_clicked(self):
+        if self.ui.preview_box.isChecked():
+            self.preview_state = None
+            self.preview_timer.start()
+        else:
+            self.preview_timer.stop()
+
+            if self.preview_worker is not None:
+                self.preview_worker.cancel()
+
+    def check_preview(self):
+        """Restart the preview if a parameter changed since it was started."""
+        state = dict(vars(self.params))
+
+        if state == self.preview_state or not os.path.isfile(str(self.params.input_file_path)):
+            return
+
+        # A level that has already started finishes but its result is dropped.
+        # The thread must not be destroyed before, so it is kept until then.
+        if self.preview_worker is not None:
+            self.preview_worker.cancel()
+            self.retire_preview_worker(self.preview_worker)
+
+        self.preview_state = state
+        self.preview_worker = PreviewWorker(self.params)
+        self.preview_worker.result.connect(self.on_preview_result)
+        self.preview_worker.failed.connect(lambda message: LOG.warn('Preview failed: %s', message))
+        self.preview_worker.start()
+
+    def retire_preview_worker(self, worker):
+        """Keep the replaced preview *worker* until its thread has finished."""
+        if not worker.isRunning():
+            return
+
+        self.retired_preview_workers.append(worker)
+        worker.finished.connect(lambda: self.release_preview_worker(worker))
+
+        # It may have finished before the connection was made.
+        if not worker.isRunning():
+            self.release_preview_worker(worker)
+
+    def release_preview_worker(self, worker):
+        if worker in self.retired_preview_workers:
+            self.retired_preview_workers.remove(worker)
+
+    def on_preview_result(self, binning, rec):
+        if self.sender() is not self.preview_worker:
+            return
+
+        self.show_slices(rec, ['Preview at binning {}'.format(binning)])
+
+    def on_show_queue(self):
+        if self.job_queue is None:
+            self.job_queue = batch.JobQueue(self.params.batch_queue)
+            self.queue_viewer.set_jobs(self.job_queue.jobs)
+
+        self.ui.queue_dock.setVisible(True)
+
+    def on_queue_add(self):
+        fnames = QtGui.QFileDialog.getOpenFileNames(self, 'Add DX files', self.input_file_path, 'Images (*.hdf *.h5)')
+        self.job_queue.add(batch.expand([str(fname) for fname in fnames]))
+        self.queue_viewer.set_jobs(self.job_queue.jobs)
+
+    def on_queue_start(self):
+        if self.queue_worker is not None and self.queue_worker.isRunning():
+            return
+
+        self.params.concurrency = self.queue_viewer.concurrency.value()
+        self.queue_worker = QueueWorker(self.job_queue, self.params, self.params.concurrency)
+        self.queue_worker.changed.connect(lambda: self.queue_viewer.set_jobs(self.job_queue.jobs))
+        self.queue_worker.failed.connect(self.gui_warn)
+        self.queue_worker.finished.connect(lambda: self.queue_viewer.set_running(False))
+        self.queue_viewer.set_running(True)
+        self.queue_worker.start()
+
+    def on_queue_stop(self):
+        if self.queue_worker is not None:
+            LOG.info('Batch queue stops after the running jobs')
+            self.queue_worker.cancel()
 
     def gui_warn(self, message):
         QtGui.QMessageBox.warning(self, "Warning", message)
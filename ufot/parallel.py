@@ -0,0 +1,67 @@
+import os
+import logging
+import multiprocessing
+from collections import OrderedDict
+
+LOG = logging.getLogger(__name__)
+
+# Pipeline stages mapped to the axis tomopy distributes the work along and
+# whether the underlying function accepts an *nchunk* argument.
+STAGES = OrderedDict([
+    ('normalize', (0, False)),
+    ('normalize_bg', (0, True)),
+    ('normalize_roi', (0, False)),
+    ('remove_stripe', (1, True)),
+    ('retrieve_phase', (0, True)),
+    ('minus_log', (0, False)),
+    ('remove_nan', (0, False)),
+    ('recon', (1, True)),
+    ('circ_mask', (0, False)),
+])
+
+
+def available_cores():
+    """Return the number of cores this process is allowed to run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return multiprocessing.cpu_count()
+
+
+def resolve(ncore, nchunk, units):
+    """
+    Return the effective (ncore, nchunk) to process *units* independent
+    pieces of work. *ncore* and *nchunk* are the configured values, None keeps
+    tomopy's default of using every core and 'auto' leaves one core free for
+    other processes on the node.
+    """
+    units = max(int(units), 1)
+    cores = available_cores()
+
+    if ncore == 'auto':
+        ncore = max(cores - 1, 1)
+    elif ncore is None:
+        ncore = cores
+
+    ncore = min(int(ncore), units)
+
+    if nchunk in (None, 'auto'):
+        nchunk = (units + ncore - 1) // ncore
+
+    return ncore, int(nchunk)
+
+
+def options(params, stage, shape):
+    """
+    Return the keyword arguments controlling parallelism of the tomopy
+    function behind *stage* when applied to data of *shape*.
+    """
+    axis, has_nchunk = STAGES[stage]
+    ncore, nchunk = resolve(params.ncore, params.nchunk, shape[axis])
+
+    if has_nchunk:
+        LOG.info('%s: ncore=%s, nchunk=%s', stage, ncore, nchunk)
+        return dict(ncore=ncore, nchunk=nchunk)
+
+    LOG.info('%s: ncore=%s', stage, ncore)
+    return dict(ncore=ncore)
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import ufot.cache as cache
+
+LOG = logging.getLogger(__name__)
+
+
+class Stage(object):
+    """
+    Step *name* of a pipeline computing its result with *func* from the
+    result of the previous stage. *parameters* are all values besides the
+    input that the result depends on.
+    """
+
+    def __init__(self, name, parameters, func):
+        self.name = name
+        self.parameters = parameters
+        self.func = func
+
+
+def stage_keys(stages):
+    """Return the key of each of *stages*, chaining the keys of the previous ones."""
+    keys = []
+    key = ''
+
+    for stage in stages:
+        key = hashlib.sha1(repr((key, stage.name, stage.parameters)).encode('utf-8')).hexdigest()
+        keys.append(key)
+
+    return keys
+
+
+class Pipeline(object):
+    """
+    Runs a list of stages and memoizes every result in a
+    cache.SinogramCache of *max_bytes*. Because a key hashes the stage
+    parameters together with the key of its input, a changed parameter only
+    reruns the stages from the first one depending on it.
+    """
+
+    def __init__(self, max_bytes):
+        self.cache = cache.SinogramCache(max_bytes)
+
+    def run(self, stages, directory=None, persistent=(), hits=None):
+        """
+        Return the result of the last of *stages*. Results of the stages
+        named in *persistent* are also kept as .npy files in *directory* so
+        that later runs can start from them. The names of the stages whose
+        result was reused are appended to the list *hits* if given.
+        """
+        keys = stage_keys(stages)
+        first = 0
+        value = None
+
+        for index in reversed(range(len(stages))):
+            value = self.cache.get(keys[index], directory if stages[index].name in persistent else None)
+
+            if value is not None:
+                first = index + 1
+                break
+
+        reused = [stage.name for stage in stages[:first]]
+
+        if reused:
+            LOG.info('Reusing cached stages: %s', ', '.join(reused))
+
+        if hits is not None:
+            hits.extend(reused)
+
+        # Cached results must stay untouched by the following stages.
+        value = cache.copy(value)
+
+        for stage, key in zip(stages[first:], keys[first:]):
+            value = stage.func(value)
+            self.cache.put(key, value if stage is stages[-1] else cache.copy(value),
+                           directory if stage.name in persistent else None)
+
+        return value
@@ -1,4 +1,8 @@
 import numpy as np
+from multiprocessing.pool import ThreadPool
+
+# Width in cycles per pixel of the low-pass applied by phase_correlation_center.
+CUTOFF = 0.1
 
 
 def guess_center(first_projection, last_projection):
@@ -22,12 +26,130 @@ def guess_center(first_projection, last_projection):
     return (width / 2.0 + center) / 2
 
 
+def bin_image(image, factor):
+    """Average *image* over blocks of *factor* x *factor* pixels."""
+    if factor <= 1:
+        return image
+
+    height = image.shape[0] // factor * factor
+    width = image.shape[1] // factor * factor
+    image = image[:height, :width]
+    return image.reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+
+def peak_offset(values, index):
+    """Sub-pixel offset of the peak at *index* from a parabola through its neighbours."""
+    left, center, right = values[index - 1], values[index], values[(index + 1) % len(values)]
+    denominator = left - 2 * center + right
+
+    if denominator == 0:
+        return 0.0
+
+    return 0.5 * (left - right) / denominator
+
+
+def phase_correlation_center(first_projection, last_projection, rows=None, binning=1, profile=False):
+    """
+    Compute the rotation center from the shift between the projection at 0
+    deg *first_projection* and the horizontally flipped projection at 180 deg
+    *last_projection* found by phase correlation. Only the rows within the
+    (start, end) tuple *rows* are used, averaged over *binning* pixels and,
+    if *profile* is True, averaged into one row. The peak is located to
+    sub-pixel precision.
+    """
+    rows = slice(*rows) if rows is not None else slice(None)
+    width = first_projection.shape[1]
+    first = bin_image(np.asarray(first_projection[rows], dtype=np.float32), binning)
+    last = bin_image(np.asarray(last_projection[rows], dtype=np.float32)[:, ::-1], binning)
+
+    if profile:
+        first = first.mean(axis=0)[np.newaxis]
+        last = last.mean(axis=0)[np.newaxis]
+
+    first -= first.mean()
+    last -= last.mean()
+
+    # Whitening only partially and damping high frequencies keeps the noise
+    # from dominating the peak.
+    cross_power = np.fft.rfft2(first) * np.conj(np.fft.rfft2(last))
+    cross_power /= np.sqrt(np.abs(cross_power)) + 1e-6
+    freq_y = np.fft.fftfreq(first.shape[0])[:, np.newaxis]
+    freq_x = np.fft.rfftfreq(first.shape[1])[np.newaxis]
+    cross_power *= np.exp(-(freq_x ** 2 + freq_y ** 2) / (2 * CUTOFF ** 2))
+    correlation = np.fft.irfft2(cross_power, s=first.shape)
+
+    # The vertical shift between both projections is zero.
+    row = correlation[0]
+    index = int(row.argmax())
+    shift = index + peak_offset(row, index)
+
+    if shift > len(row) / 2.0:
+        shift -= len(row)
+
+    # flipped_last(x) = first(x + shift) means center = (width - 1 + shift) / 2
+    return (width - 1 + shift * binning) / 2.0
+
+
+def band_centers(first_projection, last_projection, band_height=128, binning=1, num_threads=None):
+    """
+    Return the middle rows and the centers of horizontal bands of
+    *band_height* rows, each found with phase_correlation_center in a pool of
+    *num_threads* threads.
+    """
+    height = first_projection.shape[0]
+    band_height = min(band_height, height)
+    starts = range(0, height - band_height + 1, band_height)
+
+    def band_center(start):
+        return phase_correlation_center(first_projection, last_projection,
+                                        rows=(start, start + band_height), binning=binning)
+
+    pool = ThreadPool(num_threads)
+
+    try:
+        centers = pool.map(band_center, starts)
+    finally:
+        pool.close()
+
+    return np.array([start + band_height / 2.0 for start in starts]), np.array(centers)
+
+
+def fit_axis(first_projection, last_projection, band_height=128, binning=1):
+    """
+    Fit a line to the centers of horizontal bands of the projections at 0
+    and 180 deg and return the center at the middle row and its change per
+    row. Bands deviating from the first fit, e.g. those without any features,
+    are discarded before fitting again.
+    """
+    height = first_projection.shape[0]
+    rows, centers = band_centers(first_projection, last_projection, band_height, binning)
+
+    if len(rows) < 2:
+        return centers[0], 0.0
+
+    slope, intercept = np.polyfit(rows, centers, 1)
+    residuals = np.abs(centers - (intercept + slope * rows))
+    inliers = residuals <= max(3 * np.median(residuals), 0.5)
+
+    if inliers.sum() >= 2:
+        slope, intercept = np.polyfit(rows[inliers], centers[inliers], 1)
+
+    return intercept + slope * height / 2.0, slope
+
+
 class CenterCalibration(object):
 
     def __init__(self, first, last):
-        self.center = guess_center(first, last)
         self.height, self.width = first.shape
 
+        try:
+            self.center = phase_correlation_center(first, last, binning=2)
+        except (ValueError, FloatingPointError):
+            self.center = None
+
+        if self.center is None or not 0 <= self.center < self.width:
+            self.center = guess_center(first, last)
+
     @property
     def position(self):
         return self.width / 2.0 + self.width - self.center * 2.0
@@ -36,3 +158,41 @@ class CenterCalibration(object):
     def position(self, p):
         self.center = (self.width / 2.0 + self.width - p) / 2
 
+
+
+class OverlapRenderer(object):
+    """
+    Difference of *first* and *second* moved by a number of pixels along the
+    first axis. Only the overlapping part is computed, in place into a buffer
+    allocated once, the rest is zero. A copy of both images binned by
+    *preview_binning* renders previews, e.g. while dragging a slider.
+    """
+
+    def __init__(self, first, second, preview_binning=4):
+        first = np.asarray(first, dtype=np.float32)
+        second = np.asarray(second, dtype=np.float32)
+        self.shape = first.shape
+        self.levels = {1: (first, second, np.zeros(first.shape, dtype=np.float32))}
+
+        if preview_binning > 1 and min(first.shape) >= 2 * preview_binning:
+            small = (bin_image(first, preview_binning), bin_image(second, preview_binning))
+            self.levels[preview_binning] = small + (np.zeros(small[0].shape, dtype=np.float32), )
+
+        self.preview_binning = max(self.levels)
+
+    def render(self, shift, preview=False):
+        """Return second moved by *shift* pixels minus first."""
+        binning = self.preview_binning if preview else 1
+        first, second, out = self.levels[binning]
+        n = first.shape[0]
+        k = int(round(float(shift) / binning))
+        k = max(min(k, n), -n)
+
+        if k >= 0:
+            np.subtract(second[:n - k], first[k:], out=out[k:])
+            out[:k] = 0
+        else:
+            np.subtract(second[-k:], first[:n + k], out=out[:n + k])
+            out[n + k:] = 0
+
+        return out
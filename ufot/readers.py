@@ -0,0 +1,238 @@
+import os
+import logging
+import h5py
+import numpy as np
+import dxchange
+import ufot.util as util
+
+LOG = logging.getLogger(__name__)
+
+# Rows of projections read ahead to finish a chunk that straddles two passes
+# are kept for the next pass as long as they fit into this budget.
+CARRY_BYTES = 256 * 2**20
+
+# Memory used for one band of rows while building a sinogram cache.
+BAND_BYTES = 1024 * 2**20
+
+
+def open_reader(params, fname, start=None, end=None):
+    """
+    Return the reader for *fname* selected by the --reader option. Given the
+    rows *start*:*end* read in passes of params.sino_pass, a sinogram cache
+    is also used if chunks would otherwise be decompressed for every pass,
+    see needs_sinogram_cache().
+    """
+    if params.reader == 'dxchange':
+        return DxchangeReader(fname)
+
+    use_cache = params.sinogram_cache
+
+    if not use_cache and start is not None:
+        use_cache = needs_sinogram_cache(fname, start, end, int(params.sino_pass))
+
+    cache_name = sinogram_cache_name(fname) if use_cache else None
+    return SlabReader(fname, cache_name=cache_name, stop=end)
+
+
+def needs_sinogram_cache(fname, start, end, sino_pass, consecutive=True):
+    """
+    Return True if the chunks of /exchange/data in *fname* span more rows
+    than a pass of *sino_pass* of the rows *start*:*end* and the rows left
+    over do not fit into CARRY_BYTES, or passes are not *consecutive* so
+    that nothing can be carried from one to the next.
+    """
+    info = util.describe(fname).datasets['data']
+
+    if info.chunks is None or info.chunks[1] <= sino_pass or end - start <= sino_pass:
+        return False
+
+    rows = min(info.chunks[1], end - start) - sino_pass
+    row_bytes = info.shape[0] * info.shape[2] * info.dtype.itemsize
+
+    if not consecutive or rows * row_bytes > CARRY_BYTES:
+        LOG.info('Chunks of %s span %s rows, reading through a sinogram cache', fname, info.chunks[1])
+        return True
+
+    return False
+
+
+def sinogram_cache_name(fname):
+    return os.path.splitext(fname)[0] + '.sino.h5'
+
+
+class DxchangeReader(object):
+    """Read sinograms with dxchange.read_aps_32id."""
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def prepare(self):
+        pass
+
+    def read(self, start, end):
+        return dxchange.read_aps_32id(self.fname, sino=(start, end))
+
+
+class SlabReader(object):
+    """
+    Read the sinograms *start*:*end* of the Data Exchange file *fname* with
+    the strategy suited to the storage of /exchange/data:
+
+    - contiguous datasets are memory-mapped and sliced directly,
+    - chunked datasets are read one block of chunks at a time with a chunk
+      cache large enough to decompress every chunk once. Rows completing a
+      chunk beyond *end*, but not beyond *stop*, are kept for the next,
+      consecutive read,
+    - if *cache_name* is given, a sinogram-major copy of the projections is
+      written there once and all later reads come from it.
+    """
+
+    def __init__(self, fname, cache_name=None, stop=None):
+        self.fname = fname
+        self.stop = stop
+        self.descriptor = util.describe(fname)
+        self.info = self.descriptor.datasets['data']
+        self.cache_name = cache_name
+        self.chunks = self.info.chunks or (1, ) + self.info.shape[1:]
+        self.carry = None
+
+        if cache_name is not None:
+            self.mode = 'sinogram cache'
+        elif self.info.chunks is None:
+            self.mode = 'memory map'
+        else:
+            self.mode = 'chunked'
+
+        LOG.info('Reading %s through %s (chunks: %s, compression: %s)',
+                 fname, self.mode, self.info.chunks, self.info.compression)
+
+    def prepare(self):
+        """Write the sinogram cache if it is used and out of date."""
+        if self.mode == 'sinogram cache' and not self._sinogram_cache_valid():
+            self._write_sinogram_cache()
+
+    def read(self, start, end):
+        """Return projections, flats, darks and angles of sinograms *start*:*end*."""
+        if self.mode == 'sinogram cache':
+            proj = self._read_sinogram_cache(start, end)
+        elif self.mode == 'memory map':
+            proj = self._read_mapped(start, end)
+        else:
+            proj = self._read_chunked(start, end)
+
+        with h5py.File(self.fname, 'r') as f:
+            flat = self._read_small(f, 'data_white', start, end)
+            dark = self._read_small(f, 'data_dark', start, end)
+
+        return proj, flat, dark, self.descriptor.theta
+
+    def _read_small(self, f, name, start, end):
+        if name not in self.descriptor.datasets:
+            return None
+
+        return f['exchange'][name][:, start:end, :]
+
+    def _read_mapped(self, start, end):
+        with h5py.File(self.fname, 'r') as f:
+            offset = f['/exchange/data'].id.get_offset()
+
+        if offset is None:
+            # Storage has not been allocated, there is nothing to map.
+            return self._read_chunked(start, end)
+
+        mapped = np.memmap(self.fname, dtype=self.info.dtype, mode='r', offset=offset, shape=self.info.shape)
+        return np.array(mapped[:, start:end, :])
+
+    def _chunk_cache_bytes(self, rows):
+        """Chunk cache needed to hold the chunks of one block across *rows*."""
+        chunks = self.chunks
+        num_rows = (rows + chunks[1] - 1) // chunks[1] + 1
+        num_cols = (self.info.shape[2] + chunks[2] - 1) // chunks[2]
+        return max(num_rows * num_cols * int(np.prod(chunks)) * self.info.dtype.itemsize, 2**20)
+
+    def _read_rows(self, out, start, end):
+        """
+        Read rows *start*:*end* of all projections into *out*, one block of
+        chunk-aligned projections at a time.
+        """
+        chunks = self.chunks
+        nbytes = self._chunk_cache_bytes(end - start)
+
+        with h5py.File(self.fname, 'r', rdcc_nbytes=nbytes, rdcc_nslots=10007) as f:
+            dataset = f['/exchange/data']
+
+            for first in range(0, self.info.shape[0], chunks[0]):
+                last = min(first + chunks[0], self.info.shape[0])
+                dataset.read_direct(out, np.s_[first:last, start:end, :], np.s_[first:last, :, :])
+
+    def _read_chunked(self, start, end):
+        nproj, height, width = self.info.shape
+        row_bytes = nproj * width * self.info.dtype.itemsize
+        proj = np.empty((nproj, end - start, width), dtype=self.info.dtype)
+        row = start
+
+        if self.carry is not None:
+            carry_start, carry = self.carry
+            self.carry = None
+
+            if carry_start <= start < carry_start + carry.shape[1]:
+                row = min(end, carry_start + carry.shape[1])
+                proj[:, :row - start] = carry[:, start - carry_start:row - carry_start]
+
+                # Keep the rows of the following reads.
+                if row == end and end < carry_start + carry.shape[1]:
+                    self.carry = (end, carry[:, end - carry_start:])
+
+        if row == end:
+            return proj
+
+        aligned = min(-(-end // self.chunks[1]) * self.chunks[1], height, self.stop or height)
+
+        if aligned <= end or (aligned - end) * row_bytes > CARRY_BYTES:
+            aligned = end
+
+        if row == start and aligned == end:
+            self._read_rows(proj, start, end)
+            return proj
+
+        # h5py reads only into contiguous arrays
+        block = np.empty((nproj, aligned - row, width), dtype=self.info.dtype)
+        self._read_rows(block, row, aligned)
+        proj[:, row - start:] = block[:, :end - row]
+
+        if aligned > end:
+            self.carry = (end, block[:, end - row:])
+
+        return proj
+
+    def _read_sinogram_cache(self, start, end):
+        self.prepare()
+
+        with h5py.File(self.cache_name, 'r') as f:
+            return np.ascontiguousarray(f['sinograms'][start:end].swapaxes(0, 1))
+
+    def _sinogram_cache_valid(self):
+        if not os.path.exists(self.cache_name):
+            return False
+
+        with h5py.File(self.cache_name, 'r') as f:
+            return f.attrs.get('mtime') == self.descriptor.mtime
+
+    def _write_sinogram_cache(self):
+        """Transpose the projections into sinograms, one band of rows at a time."""
+        nproj, height, width = self.info.shape
+        row_bytes = nproj * width * self.info.dtype.itemsize
+        band = max(min(BAND_BYTES // row_bytes, height), 1)
+        LOG.info('Writing sinogram cache %s in bands of %s rows', self.cache_name, band)
+
+        with h5py.File(self.cache_name, 'w') as f:
+            sinograms = f.create_dataset('sinograms', (height, nproj, width),
+                                         dtype=self.info.dtype, chunks=(1, nproj, width))
+
+            for first in range(0, height, band):
+                last = min(first + band, height)
+                block = np.empty((nproj, last - first, width), dtype=self.info.dtype)
+                self._read_rows(block, first, last)
+                sinograms[first:last] = block.swapaxes(0, 1)
+
+            f.attrs['mtime'] = self.descriptor.mtime
@@ -1,79 +1,669 @@
 import os
+import copy
 import logging
 import glob
+import hashlib
 import tempfile
 import sys
+import time
+import threading
 import numpy as np
 import tomopy
-import dxchange
+from contextlib import contextmanager
+import ufot.algorithms as algorithms
+import ufot.config as config
+import ufot.parallel as parallel
+import ufot.pipeline as pipeline
+import ufot.readers as readers
+import ufot.util as util
+import ufot.volumes as volumes
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 LOG = logging.getLogger(__name__)
 
-def tomo(params):
-    fname = str(params.input_file_path)
+STAGES = ('read', 'normalize', 'phase retrieval', 'ring removal', 'recon', 'write')
+
+# Options of each stage of a single-slice reconstruction given by their
+# config sections and by name. A stage reruns when one of them changes.
+STAGE_OPTIONS = (
+    ('normalize', ('flat-field-correction', ), ()),
+    ('retrieve_phase', ('phase-retrieval', ), ()),
+    ('downsample', (), ('binning', )),
+    ('remove_stripe', ('ring-removal', ), ()),
+    ('minus_log', ('normalization', ), ()),
+    ('recon', ('ir', 'sirt', 'sirtfbp'), ('center', 'center_slope', 'reconstruction_algorithm', 'filter')),
+    ('circ_mask', (), ()),
+)
+
+# Rows read around each chunk for phase retrieval, in lengths of the
+# Paganin filter kernel, see phase_margin().
+PHASE_MARGIN = 4
+
+# Intermediate results of single-slice reconstructions, so that changing a
+# parameter only reruns the stages following the first one using it.
+PIPELINE = pipeline.Pipeline(max_bytes=1024 * 2**20)
+
+
+def get_chunks(start, end, sino_pass):
+    """
+    Split the slice range *start*:*end* into (start, end) tuples of at most
+    *sino_pass* sinograms each.
+    """
+    step = max(int(sino_pass), 1)
+    return [(s, min(s + step, end)) for s in range(start, end, step)]
+
+
+class Cancelled(Exception):
+    """Raised when a reconstruction is cancelled between two chunks."""
+    pass
 
+
+def check_cancelled(cancel):
+    """Raise Cancelled if the *cancel* event is set."""
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Reconstruction cancelled")
+
+
+def reporter(progress, index, total):
+    """
+    Return a function reporting the pipeline stage of chunk *index* out of
+    *total* to the *progress* callback.
+    """
+    if progress is None:
+        return lambda stage: None
+
+    return lambda stage: progress(stage, index, total)
+
+
+def slice_range(params):
+    """Return the first and one past the last slice reconstructed with *params*."""
     start = params.slice_start
     end = params.slice_end
 
-   # Read raw data.
-    if  (params.full_reconstruction == False) : 
+    if  (params.full_reconstruction == False) :
         end = start + 1
-    
 
-#    LOG.info('Slice start/end: %s', end)
+    height = util.describe(str(params.input_file_path)).shape('data')[1]
+    if end > height:
+        LOG.warn('Slice end %s is beyond the detector height, using %s', end, height)
+        end = height
+
+    return start, end
+
 
-    proj, flat, dark, theta = dxchange.read_aps_32id(fname, sino=(start, end))
+def tomo(params, progress=None, cancel=None, result=None, on_iterate=None, hits=None):
+    """
+    Reconstruct the slices selected in *params*. *progress* is called with
+    the name of each stage in STAGES, the chunk index and the number of chunks
+    as the pipeline advances. Setting the *cancel* event stops the
+    reconstruction before the next chunk by raising Cancelled. *result* is
+    called with the first slice and the reconstruction of every chunk so that
+    callers can use them without reading the written files. Chunks are
+    written in the background, unless params.dry_run is set. Iterative
+    algorithms call *on_iterate* with the first slice of the chunk, the
+    number of iterations done and the current estimate, and can be cancelled
+    between iterations. The names of the stages of single-slice
+    reconstructions taken from PIPELINE are appended to the list *hits*.
+    """
+    fname = str(params.input_file_path)
+    start, end = slice_range(params)
+    chunks = get_chunks(start, end, params.sino_pass)
     LOG.info('Slice start/end: %s, %s', start, end)
-    LOG.info('Data successfully imported: %s', fname)
+    LOG.info('Processing %s sinograms per pass in %s passes', params.sino_pass, len(chunks))
+
+    if params.full_reconstruction and params.fit_axis:
+        import ufot.center as center
+        params = copy.copy(params)
+        params.center, params.center_slope = center.fit_axis(fname)
+
+    if params.full_reconstruction and (params.workers > 0 or params.launcher == 'mpi'):
+        import ufot.distributed as distributed
+
+        if result is not None:
+            LOG.warn('Workers only write their chunks, nothing is returned in memory')
+
+        distributed.run(params, fname, chunks, start)
+        return
+
+    reader = readers.open_reader(params, fname, *read_range(fname, start, end, phase_margin(params)))
+    iterate = None
+
+    if cancel is not None or on_iterate is not None:
+        def iterate(chunk_start, iteration, rec, residual):
+            check_cancelled(cancel)
+
+            if on_iterate is not None:
+                on_iterate(chunk_start, iteration, rec)
+
+    if params.stream and len(chunks) > 1:
+        stream(params, reader, chunks, start, progress, cancel, result, iterate)
+        return
+
+    writer = ChunkWriter(params, start, end) if (params.dry_run == False) else None
+
+    try:
+        for index, (chunk_start, chunk_end) in enumerate(chunks):
+            check_cancelled(cancel)
+            report = reporter(progress, index, len(chunks))
+
+            if (params.full_reconstruction == False):
+                rec = PIPELINE.run(slice_stages(params, reader, chunk_start, chunk_end, report, iterate),
+                                   directory=params.cache_dir, persistent=('minus_log', ), hits=hits)
+            else:
+                report('read')
+                rec = reconstruct(params, *read(reader, chunk_start, chunk_end, phase_margin(params)),
+                                  report=report, start=chunk_start, on_iterate=iterate)
+
+            if result is not None:
+                result(chunk_start, rec)
+
+            if writer is not None:
+                writer.put(chunk_start, rec, report)
+    except:
+        if writer is not None:
+            writer.close(check=False)
+        raise
+
+    if writer is not None:
+        writer.close()
+
+    if  (params.full_reconstruction == False) :
+        return rec
+
+
+def preview(params, on_result, progress=None, cancel=None):
+    """
+    Reconstruct slice params.slice_start at binning 3, 2 and so on down to
+    params.binning and call *on_result* with the binning and the slice of each
+    level as soon as it is done. Nothing is written, neither the output nor
+    cached stages, sinogram caches or checkpoints, and the levels share the stages before the
+    binning through PIPELINE in memory. *progress* and *cancel* work as for
+    tomo, with one chunk per level.
+    """
+    levels = [str(binning) for binning in range(3, int(params.binning) - 1, -1)]
+
+    for index, binning in enumerate(levels):
+        check_cancelled(cancel)
+        level_params = copy.copy(params)
+        level_params.binning = binning
+        level_params.full_reconstruction = False
+        level_params.dry_run = True
+        level_params.cache_dir = None
+        level_params.checkpoint_dir = None
+        level_params.sinogram_cache = False
+        report = reporter(progress, index, len(levels))
+        on_result(binning, tomo(level_params, progress=lambda stage, i, n: report(stage), cancel=cancel))
+
+
+class Volume(object):
+    """
+    Result callback for tomo collecting the chunks of slices *start*:*end*
+    into one array, *data*, allocated with the first chunk.
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.data = None
+
+    def __call__(self, chunk_start, rec):
+        if self.data is None:
+            self.data = np.empty((self.end - self.start, ) + rec.shape[1:], dtype=rec.dtype)
+
+        first = chunk_start - self.start
+        self.data[first:first + rec.shape[0]] = rec
+
+
+class ChunkWriter(object):
+    """
+    Write reconstructed chunks of slices *offset*:*end* in a background
+    thread, numbering the slices relative to *offset*. At most *depth* chunks
+    wait to be written, putting more blocks. An error of the writer is raised
+    by the next put or close.
+    """
+
+    def __init__(self, params, offset, end, depth=1):
+        self.writer = volumes.writer(params)
+        self.writer.prepare(output_shape(params, offset, end), np.float32)
+        self.offset = offset
+        self.queue = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                return
+
+            # Keep taking chunks after an error so that put never blocks.
+            if self.error is None:
+                chunk_start, rec, report = item
+
+                try:
+                    report('write')
+                    self.writer.write(rec, chunk_start - self.offset)
+                except Exception as e:
+                    self.error = e
+
+    def put(self, chunk_start, rec, report=None):
+        """Queue *rec*, the chunk starting at slice *chunk_start*."""
+        if self.error is not None:
+            raise self.error
+
+        self.queue.put((chunk_start, rec, report or (lambda stage: None)))
+
+    def close(self, check=True):
+        """Wait until all chunks are written and raise a write error if *check* is True."""
+        self.queue.put(None)
+        self.thread.join()
+
+        if check and self.error is not None:
+            raise self.error
+
+
+def stream(params, reader, chunks, offset, progress=None, cancel=None, result=None, on_iterate=None):
+    """
+    Reconstruct *chunks* while a reader thread prefetches the next pass and a
+    ChunkWriter stores the previous one. Both hold a single pass so at most
+    four passes are in memory at any time. Slices are numbered relative to
+    *offset*, *result* and *on_iterate* are called as in tomo.
+    """
+    read_queue = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    errors = []
+
+    def read_chunks():
+        try:
+            for index, (chunk_start, chunk_end) in enumerate(chunks):
+                reporter(progress, index, len(chunks))('read')
+                data = read(reader, chunk_start, chunk_end, phase_margin(params))
+                if not _put(read_queue, (index, chunk_start, data), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        _put(read_queue, None, stop)
+
+    thread = threading.Thread(target=read_chunks)
+    thread.daemon = True
+    thread.start()
+    writer = ChunkWriter(params, offset, chunks[-1][1]) if (params.dry_run == False) else None
+
+    try:
+        while True:
+            check_cancelled(cancel)
+            item = _get(read_queue, stop)
+            if item is None:
+                break
+            index, chunk_start, data = item
+            report = reporter(progress, index, len(chunks))
+            rec = reconstruct(params, *data, report=report, start=chunk_start, on_iterate=on_iterate)
+            if result is not None:
+                result(chunk_start, rec)
+            if writer is not None:
+                writer.put(chunk_start, rec, report)
+    except:
+        stop.set()
+        if writer is not None:
+            writer.close(check=False)
+        raise
+    finally:
+        thread.join()
+
+    if writer is not None:
+        writer.close()
+
+    if errors:
+        raise errors[0]
+
+
+def _put(q, item, stop):
+    """Put *item* into *q* unless *stop* is set while waiting for room."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def _get(q, stop):
+    """Get the next item from *q* or None once *stop* is set."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    return None
+
+
+def read_range(fname, start, end, margin=0):
+    """Return the rows of *fname* read for sinograms *start*:*end* with *margin* rows around them."""
+    height = util.describe(fname).shape('data')[1]
+    return max(start - margin, 0), min(end + margin, height)
+
+
+def read(reader, start, end, margin=0):
+    """
+    Read the sinograms *start*:*end* and *margin* rows around them with
+    *reader*. Return the projections, flats, darks, angles and the slice of
+    the rows *start*:*end* within the ones read.
+    """
+    first, last = read_range(reader.fname, start, end, margin)
+    proj, flat, dark, theta = reader.read(first, last)
+    LOG.info('Chunk start/end: %s, %s (read %s, %s)', start, end, first, last)
+    LOG.info('Data successfully imported: %s', reader.fname)
     LOG.info('Projections: %s', proj.shape)
     LOG.info('Flat: %s', flat.shape)
     LOG.info('Dark: %s', dark.shape)
 
-    # Flat-field correction of raw data.
-    data = tomopy.normalize(proj, flat, dark)
+    return proj, flat, dark, theta, slice(start - first, end - first)
+
+
+def reconstruct(params, proj, flat, dark, theta, rows=None, report=None, start=0, on_iterate=None):
+    """
+    Pre-process and reconstruct one chunk of raw data starting at detector row
+    *start*. *rows* selects the chunk within the raw data if it has been read
+    with a margin. Only this chunk is held in memory. *report* is called with
+    the name of each stage as it starts.
+    """
+    data = preprocess(params, proj, flat, dark, report, rows)
+    return recon(params, data, theta, report, start, on_iterate)
+
+
+def stage_options(params, sections, names):
+    """Return the values of all options in *sections* and of *names*."""
+    values = []
+
+    for section in sections:
+        for name in sorted(config.SECTIONS[section]):
+            values.append((name, getattr(params, name.replace('-', '_'), None)))
+
+    return values + [(name, getattr(params, name)) for name in names]
+
+
+def slice_stages(params, reader, start, end, report=None, on_iterate=None):
+    """
+    Return the pipeline stages reconstructing the sinograms *start*:*end*
+    read by *reader*, together with the margin of rows phase retrieval
+    needs, keyed by the file, its modification time and the options in
+    STAGE_OPTIONS.
+    """
+    report = report or (lambda stage: None)
+    theta = util.describe(reader.fname).theta
+    margin = phase_margin(params)
+    first, last = read_range(reader.fname, start, end, margin)
+    rows = slice(start - first, end - first)
+
+    def read_stage(value):
+        report('read')
+        return read(reader, start, end, margin)[:3]
+
+    funcs = {
+        'normalize': lambda raw: normalize(params, *raw, report=report),
+        'retrieve_phase': lambda data: retrieve_phase(params, data, report=report, rows=rows),
+        'downsample': lambda data: downsample(params, data),
+        'remove_stripe': lambda data: remove_stripe(params, data, report=report),
+        'minus_log': lambda data: minus_log(params, data),
+        'recon': lambda data: backproject(params, data, theta, report=report, start=start, on_iterate=on_iterate),
+        'circ_mask': lambda rec: mask(params, rec),
+    }
+
+    stages = [pipeline.Stage('read', (reader.fname, util.describe(reader.fname).mtime, start, end, first, last), read_stage)]
+
+    for name, sections, names in STAGE_OPTIONS:
+        stages.append(pipeline.Stage(name, stage_options(params, sections, names), funcs[name]))
+
+    return stages
+
+
+def preprocessed(params, reader, start, end, report=None):
+    """
+    Return the pre-processed sinograms *start*:*end* read by *reader*, taken
+    from PIPELINE if they have been computed before.
+    """
+    stages = [stage for stage in slice_stages(params, reader, start, end, report)
+              if stage.name not in ('recon', 'circ_mask')]
+    return PIPELINE.run(stages, directory=params.cache_dir, persistent=('minus_log', ))
+
+
+def preprocess(params, proj, flat, dark, report=None, rows=None):
+    """
+    Return flat-field corrected, phase-retrieved, binned, ring-filtered and
+    log'ed data, each step as configured in *params*. *rows* selects the
+    sinograms to keep after phase retrieval, the others are only read for it.
+    """
+    data = normalize(params, proj, flat, dark, report)
+
+    # Release the raw data before the next allocation.
+    del proj, flat, dark
+
+    data = retrieve_phase(params, data, report, rows)
+    data = downsample(params, data)
+    data = remove_stripe(params, data, report)
+    return minus_log(params, data)
+
+
+@contextmanager
+def timed(name):
+    """Log the time spent in stage *name*."""
+    start = time.time()
+    yield
+    LOG.info('%s took %.3f s', name, time.time() - start)
+
+
+def normalize(params, proj, flat, dark, report=None):
+    """
+    Flat-field correction of raw data. With params.flat_field, values are cut
+    off at params.cut_off and params.flat_field_method 'background' or 'roi'
+    additionally scales each projection to its air pixels or to a region.
+    """
+    (report or (lambda stage: None))('normalize')
+    method = params.flat_field_method if params.flat_field else 'default'
+    cutoff = params.cut_off if params.flat_field else None
+
+    with timed('normalize'):
+        data = tomopy.normalize(proj, flat, dark, cutoff=cutoff,
+                                **parallel.options(params, 'normalize', proj.shape))
+
+    if method == 'background':
+        with timed('normalize_bg'):
+            data = tomopy.normalize_bg(data, air=params.air,
+                                       **parallel.options(params, 'normalize_bg', data.shape))
+    elif method == 'roi':
+        roi = [int(params.roi_ty), int(params.roi_tx), int(params.roi_by), int(params.roi_bx)]
+
+        with timed('normalize_roi'):
+            data = tomopy.normalize_roi(data, roi=roi, **parallel.options(params, 'normalize_roi', data.shape))
+
     LOG.info('Normalization completed')
+    return data
 
+
+def downsample(params, data):
     data = tomopy.downsample(data, level=int(params.binning))
     LOG.info('Binning: %s', params.binning)
+    return data
+
+
+def stripe_options(params):
+    """Return the tomopy function and options of params.ring_removal_method."""
+    if params.ring_removal_method == 'wavelet':
+        return tomopy.remove_stripe_fw, dict(level=params.wavelet_level or None, wname=params.wavelet_filter,
+                                             sigma=params.wavelet_sigma, pad=params.wavelet_padding)
+
+    if params.ring_removal_method == 'titarenko':
+        return tomopy.remove_stripe_ti, {}
+
+    if params.ring_removal_method == 'smoothing':
+        return tomopy.remove_stripe_sf, {}
+
+    return None, {}
 
-    # remove stripes
-    data = tomopy.remove_stripe_fw(data,level=5,wname='sym16',sigma=1,pad=True)
-    LOG.info('Ring removal completed')    
 
-    # phase retrieval
-    #data = tomopy.prep.phase.retrieve_phase(data,pixel_size=detector_pixel_size_x,dist=sample_detector_distance,energy=monochromator_energy,alpha=8e-3,pad=True)
+def remove_stripe(params, data, report=None):
+    """Remove stripes of the sinograms with params.ring_removal_method, if any."""
+    func, options = stripe_options(params)
 
-    # Find rotation center
-    #rot_center = tomopy.find_center(proj, theta, init=290, ind=0, tol=0.5)
+    if func is None:
+        return data
+
+    (report or (lambda stage: None))('ring removal')
+    options.update(parallel.options(params, 'remove_stripe', data.shape))
+
+    with timed('remove_stripe ({})'.format(params.ring_removal_method)):
+        data = func(data, **options)
+
+    LOG.info('Ring removal completed')
+    return data
+
+
+def check_phase_options(params):
+    if None in (params.energy, params.propagation_distance, params.pixel_size):
+        raise ValueError("Phase retrieval needs --energy, --propagation-distance and --pixel-size")
+
+
+def phase_margin(params):
+    """
+    Return the number of rows to read above and below a chunk so that Paganin
+    phase retrieval of its rows does not depend on the chunk size, i.e.
+    PHASE_MARGIN times the length of the filter kernel in pixels, or 0 if
+    params.phase_method is not set.
+    """
+    if params.phase_method != 'paganin':
+        return 0
+
+    check_phase_options(params)
+
+    # The Paganin filter 1 / (wavelength * dist * |k|^2 / (4 pi) + alpha) decays
+    # over sqrt(wavelength * dist / (4 pi alpha)), in m with the energy in keV.
+    wavelength = 2 * np.pi * 6.58211928e-19 * 299792458.0 / params.energy
+    length = np.sqrt(wavelength * params.propagation_distance / (4 * np.pi * params.alpha))
+    return int(np.ceil(PHASE_MARGIN * length / params.pixel_size))
+
+
+def retrieve_phase(params, data, report=None, rows=None):
+    """
+    Paganin phase retrieval of the normalized, unbinned projections if
+    params.phase_method is set. Return the sinograms *rows*, all by default;
+    the others are only read to filter them like whole projections.
+    """
+    if params.phase_method == 'paganin':
+        check_phase_options(params)
+        (report or (lambda stage: None))('phase retrieval')
+
+        # tomopy expects lengths in cm. Pixels are square before binning,
+        # which only bins horizontally.
+        with timed('retrieve_phase'):
+            data = tomopy.retrieve_phase(data, pixel_size=params.pixel_size * 100,
+                                         dist=params.propagation_distance * 100,
+                                         energy=params.energy, alpha=params.alpha, pad=params.pad,
+                                         **parallel.options(params, 'retrieve_phase', data.shape))
+
+        LOG.info('Phase retrieval completed')
+
+    if rows is not None and (rows.start, rows.stop) != (0, data.shape[1]):
+        data = np.ascontiguousarray(data[:, rows])
+
+    return data
+
+
+def minus_log(params, data):
+    """Take the negative logarithm and replace NaNs if set in params."""
+    if params.minus_log:
+        with timed('minus_log'):
+            data = tomopy.minus_log(data, **parallel.options(params, 'minus_log', data.shape))
+
+        LOG.info('Minus log compled')
+
+    if params.nan_and_inf:
+        with timed('remove_nan'):
+            data = tomopy.remove_nan(data, val=0.0, **parallel.options(params, 'remove_nan', data.shape))
+
+    return data
+
+
+def recon(params, data, theta, report=None, start=0, on_iterate=None):
+    """Reconstruct and mask the pre-processed sinograms *data*."""
+    return mask(params, backproject(params, data, theta, report, start, on_iterate))
+
+
+def axis_centers(params, start, end):
+    """
+    Return the rotation center of binned sinograms *start*:*end*. params.center
+    is the center at the middle row of the detector, which moves by
+    params.center_slope pixels per row if the rotation axis is tilted.
+    """
+    scale = np.power(2, float(params.binning))
+
+    if not params.center_slope:
+        return params.center / scale
+
+    middle = util.describe(str(params.input_file_path)).shape('data')[1] / 2.0
+    return (params.center + params.center_slope * (np.arange(start, end) - middle)) / scale
+
+
+def checkpoint_key(params, start, end):
+    """
+    Return the key of the checkpoints of sinograms *start*:*end*, which
+    depends on the input and the pre-processing but not on the algorithm.
+    """
+    descriptor = util.describe(str(params.input_file_path))
+    options = [stage_options(params, sections, names) for name, sections, names in STAGE_OPTIONS
+               if name not in ('recon', 'circ_mask')]
+    values = (descriptor.fname, descriptor.mtime, start, end, options, params.center, params.center_slope)
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
+def backproject(params, data, theta, report=None, start=0, on_iterate=None):
+    """
+    Reconstruct the pre-processed sinograms *data* starting at detector row
+    *start*. *on_iterate* is called with *start*, the iteration, the
+    estimate and its residual by iterative algorithms.
+    """
+    report = report or (lambda stage: None)
 
     # Set rotation center.
-    rot_center = params.center/np.power(2, float(params.binning))
+    rot_center = axis_centers(params, start, start + data.shape[1])
     LOG.info('Rotation center: %s', rot_center)
 
-    data = tomopy.minus_log(data)
-    LOG.info('Minus log compled')
-
     # Reconstruct object using Gridrec algorithm.
+    report('recon')
     LOG.info('Reconstruction started using %s', params.reconstruction_algorithm)
-    if (str(params.reconstruction_algorithm) == 'sirt'):
-        LOG.info('Iteration: %s', params.iteration_count)
-        rec = tomopy.recon(data, theta,  center=rot_center, algorithm='sirt', num_iter=params.iteration_count)
-    else:
-        LOG.info('Filter: %s', params.filter)
-        rec = tomopy.recon(data, theta, center=rot_center, algorithm='gridrec', filter_name=params.filter)
+    key = checkpoint_key(params, start, start + data.shape[1]) if params.checkpoint_dir else None
+    iterate = (lambda *args: on_iterate(start, *args)) if on_iterate is not None else None
+    rec = algorithms.reconstruct(params, data, theta, rot_center, parallel.options(params, 'recon', data.shape),
+                                 key=key, on_iterate=iterate)
 
     LOG.info('Reconstrion of %s completed', rec.shape)
+    return rec
 
-    # Mask each reconstructed slice with a circle.
-    rec = tomopy.circ_mask(rec, axis=0, ratio=0.95)
 
-    
-    if (params.dry_run == False):
-         # Write data as stack of TIFs.
-        fname = str(params.output_path) + 'reco'
-        dxchange.write_tiff_stack(rec, fname=fname, overwrite=True)
-        LOG.info('Reconstrcution saved: %s', fname)
+def mask(params, rec):
+    """Mask each reconstructed slice with a circle."""
+    return tomopy.circ_mask(rec, axis=0, ratio=0.95, **parallel.options(params, 'circ_mask', rec.shape))
+
+
+def output_shape(params, start, end):
+    """Return the shape of the reconstruction of slices *start*:*end*."""
+    width = util.describe(str(params.input_file_path)).shape('data')[2] // 2 ** int(params.binning)
+    return (end - start, width, width)
 
-    if  (params.full_reconstruction == False) :
-        return rec
 
+def write(params, rec, offset=0):
+    """
+    Write *rec* in params.output_format, starting at slice *offset* so that
+    consecutive chunks continue the same volume. Except for TIFs, the volume
+    must have been prepared by the writer beforehand.
+    """
+    volumes.writer(params).write(rec, offset)
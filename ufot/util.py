@@ -1,5 +1,72 @@
+import os
+import argparse
+import threading
 import h5py
 import dxchange
+import numpy as np
+
+_DESCRIPTORS = {}
+_DESCRIPTORS_LOCK = threading.Lock()
+
+
+class DatasetInfo(object):
+    """Shape, data type and storage layout of an HDF5 *dataset*."""
+
+    def __init__(self, dataset):
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.chunks = dataset.chunks
+        self.compression = dataset.compression
+
+
+class Descriptor(object):
+    """
+    Layout of the /exchange group of the Data Exchange file *fname* read in a
+    single pass: a DatasetInfo per dataset, the rotation angles in radians
+    and the modification time of the file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.mtime = os.path.getmtime(fname)
+        self.datasets = {}
+        self.theta = None
+
+        with h5py.File(fname, "r") as f:
+            group = f['exchange'] if 'exchange' in f else {}
+
+            for name in group:
+                if isinstance(group[name], h5py.Dataset):
+                    self.datasets[name] = DatasetInfo(group[name])
+
+            if 'theta' in self.datasets:
+                self.theta = np.deg2rad(group['theta'][...])
+
+        if self.theta is None and 'data' in self.datasets:
+            self.theta = np.linspace(0, np.pi, self.datasets['data'].shape[0])
+
+    def shape(self, dataset):
+        """Return the shape of *dataset* or None if it does not exist."""
+        info = self.datasets.get(dataset)
+        return info.shape if info is not None else None
+
+
+def describe(fname):
+    """
+    Return the Descriptor of the Data Exchange file *fname*. Descriptors are
+    cached per path and read again once the file has been modified.
+    """
+    fname = os.path.abspath(str(fname))
+    mtime = os.path.getmtime(fname)
+
+    with _DESCRIPTORS_LOCK:
+        descriptor = _DESCRIPTORS.get(fname)
+
+        if descriptor is None or descriptor.mtime != mtime:
+            descriptor = Descriptor(fname)
+            _DESCRIPTORS[fname] = descriptor
+
+    return descriptor
 
 def get_dx_dims(fname, dataset):
     """
@@ -16,20 +83,23 @@ def get_dx_dims(fname, dataset):
         Data set size.
     """
 
-    grp = '/'.join(['exchange', dataset])
+    return describe(fname).shape(dataset)
 
-    with h5py.File(fname, "r") as f:
-        try:
-            data = f[grp]
-        except KeyError:
-            return None
+def theta_step(start, end, proj_number):
+    return (end-start)/proj_number
 
-        shape = data.shape
+def str2bool(value):
+    """Convert *value*, e.g. 'True', 'false', 'yes' or '0', to a bool."""
+    if isinstance(value, bool):
+        return value
 
-    return shape
+    if str(value).lower() in ('true', 'yes', 'on', '1'):
+        return True
 
-def theta_step(start, end, proj_number):
-    return (end-start)/proj_number
+    if str(value).lower() in ('false', 'no', 'off', '0'):
+        return False
+
+    raise argparse.ArgumentTypeError('{} is not a boolean'.format(value))
 
 def positive_int(value):
     """Convert *value* to an integer and make sure it is positive."""
@@ -39,6 +109,23 @@ def positive_int(value):
 
     return result
 
+def positive_int_or_auto(value):
+    """
+    Convert *value* to a positive integer, keep the string 'auto' and map
+    'None' to None.
+    """
+    if value is None or value == 'None':
+        return None
+
+    if value == 'auto':
+        return value
+
+    result = int(value)
+    if result < 1:
+        raise argparse.ArgumentTypeError("Only integers greater than zero or 'auto' are allowed")
+
+    return result
+
 def range_list(value):
     """
     Split *value* separated by ':' into int triple, filling missing values with 1s.
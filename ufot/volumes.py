@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import zlib
+import logging
+import h5py
+import numpy as np
+import dxchange
+
+LOG = logging.getLogger(__name__)
+
+# Size in pixels of the square tiles a slice is split into in directory stores.
+TILE = 512
+
+# Names of the chunk files of directory stores.
+CHUNK_NAME = re.compile(r'^\d+\.\d+\.\d+$')
+
+
+EXTENSIONS = {'tiff': '', 'hdf5': '.h5', 'zarr': '.zarr'}
+
+
+def output_name(params):
+    """Return the file, directory or TIF prefix of the volume written with *params*."""
+    return str(params.output_path) + 'reco' + EXTENSIONS[params.output_format]
+
+
+def writer(params):
+    """Return the writer of the --output-format selected in *params*."""
+    fname = output_name(params)
+    compression = params.output_compression if params.output_compression != 'none' else None
+
+    if params.output_format == 'hdf5':
+        return Hdf5Writer(fname, compression)
+
+    if params.output_format == 'zarr':
+        return DirectoryWriter(fname, int(params.sino_pass), compression)
+
+    return TiffWriter(fname)
+
+
+class TiffWriter(object):
+    """Write slices as a stack of TIFs named after *fname*."""
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def prepare(self, shape, dtype):
+        pass
+
+    def write(self, rec, offset):
+        dxchange.write_tiff_stack(rec, fname=self.fname, start=offset, overwrite=True)
+        LOG.info('Reconstrcution saved: %s', self.fname)
+
+
+class Hdf5Writer(object):
+    """
+    Write slices into /exchange/data of the HDF5 file *fname*, chunked by
+    slice and compressed with *compression* if given. Only one process may
+    write at a time.
+    """
+
+    def __init__(self, fname, compression=None):
+        self.fname = fname
+        self.compression = compression
+
+    def prepare(self, shape, dtype):
+        """
+        Create the dataset unless one with slices of the same shape and type
+        exists, which is extended if needed so that, like TIFs, slices
+        written before and not written again are kept.
+        """
+        with h5py.File(self.fname, 'a') as f:
+            if '/exchange/data' in f:
+                dataset = f['/exchange/data']
+
+                if dataset.shape[1:] == tuple(shape[1:]) and dataset.dtype == np.dtype(dtype) and \
+                        (dataset.shape[0] >= shape[0] or dataset.maxshape[0] is None):
+                    if dataset.shape[0] < shape[0]:
+                        dataset.resize(shape[0], axis=0)
+                    return
+
+                del f['/exchange/data']
+
+            f.create_dataset('/exchange/data', shape, dtype=dtype, maxshape=(None, ) + tuple(shape[1:]),
+                             chunks=(1, ) + tuple(shape[1:]), compression=self.compression)
+
+    def write(self, rec, offset):
+        with h5py.File(self.fname, 'r+') as f:
+            f['/exchange/data'][offset:offset + rec.shape[0]] = rec
+
+        LOG.info('Reconstrcution saved: %s [%s:%s]', self.fname, offset, offset + rec.shape[0])
+
+
+class DirectoryWriter(object):
+    """
+    Write slices into the directory *path* in the layout of a Zarr (v2)
+    directory store: one file per chunk of *depth* slices and TILE x TILE
+    pixels, compressed with zlib if *compression* is given. Slabs starting at
+    multiples of *depth* go to separate files and can be written by several
+    processes at once. Slabs ending within a chunk keep the slices of it
+    written before.
+    """
+
+    def __init__(self, path, depth, compression=None):
+        self.path = path
+        self.depth = depth
+        self.compression = compression
+        self.dtype = None
+
+    def prepare(self, shape, dtype):
+        """
+        Write the metadata of the volume. An existing store with the same
+        chunks, type and compression is kept and extended if needed, any
+        other one is replaced.
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        metadata = {
+            'zarr_format': 2,
+            'shape': list(shape),
+            'chunks': [self.depth, min(TILE, shape[1]), min(TILE, shape[2])],
+            'dtype': np.dtype(dtype).str,
+            'compressor': {'id': 'zlib', 'level': 1} if self.compression else None,
+            'fill_value': 0,
+            'order': 'C',
+            'filters': None,
+        }
+
+        existing = self._metadata()
+
+        if existing is not None:
+            if all(existing[key] == metadata[key] for key in ('chunks', 'dtype', 'compressor')) and \
+                    existing['shape'][1:] == metadata['shape'][1:]:
+                metadata['shape'][0] = max(metadata['shape'][0], existing['shape'][0])
+            else:
+                for name in os.listdir(self.path):
+                    if CHUNK_NAME.match(name):
+                        os.remove(os.path.join(self.path, name))
+
+        with open(os.path.join(self.path, '.zarray'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+    def _metadata(self):
+        fname = os.path.join(self.path, '.zarray')
+
+        if not os.path.exists(fname):
+            return None
+
+        with open(fname) as f:
+            return json.load(f)
+
+    def write(self, rec, offset):
+        if offset % self.depth:
+            raise ValueError("Slab at {} does not start at a multiple of {}".format(offset, self.depth))
+
+        # Workers only see the metadata written by the prepared writer.
+        if self.dtype is None:
+            self.dtype = np.dtype(self._metadata()['dtype'])
+
+        tile_y, tile_x = min(TILE, rec.shape[1]), min(TILE, rec.shape[2])
+
+        for z in range(0, rec.shape[0], self.depth):
+            for y in range(0, rec.shape[1], tile_y):
+                for x in range(0, rec.shape[2], tile_x):
+                    part = rec[z:z + self.depth, y:y + tile_y, x:x + tile_x]
+                    name = '{}.{}.{}'.format((offset + z) // self.depth, y // tile_y, x // tile_x)
+                    block = self._read_chunk(name, tile_y, tile_x) if part.shape[0] < self.depth else None
+
+                    if block is None:
+                        block = np.zeros((self.depth, tile_y, tile_x), dtype=self.dtype)
+
+                    block[:part.shape[0], :part.shape[1], :part.shape[2]] = part
+                    self._write_chunk(name, block)
+
+        LOG.info('Reconstrcution saved: %s [%s:%s]', self.path, offset, offset + rec.shape[0])
+
+    def _read_chunk(self, name, tile_y, tile_x):
+        """Return a writable copy of chunk *name* or None if it does not exist."""
+        fname = os.path.join(self.path, name)
+
+        if not os.path.exists(fname):
+            return None
+
+        with open(fname, 'rb') as f:
+            data = f.read()
+
+        if self.compression:
+            data = zlib.decompress(data)
+
+        return np.frombuffer(data, dtype=self.dtype).reshape((self.depth, tile_y, tile_x)).copy()
+
+    def _write_chunk(self, name, block):
+        data = block.tobytes()
+
+        if self.compression:
+            data = zlib.compress(data, 1)
+
+        tmp_name = os.path.join(self.path, '.' + name + '.tmp')
+
+        with open(tmp_name, 'wb') as f:
+            f.write(data)
+
+        os.rename(tmp_name, os.path.join(self.path, name))
+
+
+class DirectoryVolume(object):
+    """
+    Read-only, lazily loaded volume in the directory store at *path*.
+    Indexing the first axis reads only the chunks of the selected slices.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, '.zarray')) as f:
+            metadata = json.load(f)
+
+        self.shape = tuple(metadata['shape'])
+        self.chunks = tuple(metadata['chunks'])
+        self.dtype = np.dtype(metadata['dtype'])
+        self.compressed = metadata['compressor'] is not None
+        self.fill_value = metadata['fill_value'] or 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read_chunk(self, index):
+        fname = os.path.join(self.path, '.'.join(str(i) for i in index))
+
+        if not os.path.exists(fname):
+            return np.full(self.chunks, self.fill_value, dtype=self.dtype)
+
+        with open(fname, 'rb') as f:
+            data = f.read()
+
+        if self.compressed:
+            data = zlib.decompress(data)
+
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.chunks)
+
+    def slice(self, z):
+        """Return slice *z*."""
+        depth, tile_y, tile_x = self.chunks
+        result = np.empty(self.shape[1:], dtype=self.dtype)
+
+        for y in range(0, self.shape[1], tile_y):
+            for x in range(0, self.shape[2], tile_x):
+                chunk = self._read_chunk((z // depth, y // tile_y, x // tile_x))
+                part = result[y:y + tile_y, x:x + tile_x]
+                part[...] = chunk[z % depth, :part.shape[0], :part.shape[1]]
+
+        return result
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+
+        if isinstance(key[0], slice):
+            return np.array([self.slice(z)[key[1:]] for z in range(*key[0].indices(self.shape[0]))])
+
+        z = key[0] + self.shape[0] if key[0] < 0 else key[0]
+        return self.slice(z)[key[1:]]
+
+
+def open_volume(path):
+    """
+    Return the volume written to *path* by the HDF5 or directory writer as
+    a lazily read array, or None if *path* holds neither.
+    """
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, '.zarray')):
+        return DirectoryVolume(path)
+
+    if os.path.isfile(path) and h5py.is_hdf5(path):
+        return h5py.File(path, 'r')['/exchange/data']
+
+    return None
@@ -1,10 +1,15 @@
 import pyqtgraph as pg
 import pyqtgraph.opengl as gl
 import logging
+import threading
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from PyQt4 import QtGui, QtCore
 import dxchange as dx
 import ufot.util as util
+import ufot.process
+import ufot.cache as cache
+import ufot.parallel as parallel
 import tifffile
 
 LOG = logging.getLogger(__name__)
@@ -17,20 +22,62 @@ def remove_extrema(data):
     data[data < lower] = lower
     return data
 
-def create_volume(data):
-    gradient = (data - np.roll(data, 1))**2
-    cmin = gradient.min()
-    div = gradient.max() - cmin
-    gradient = (gradient - cmin) / div * 255
+# Bytes per displayed voxel, the float slices plus their RGBA volume.
+VOXEL_BYTES = 8
 
+
+def to_ubyte(data, low, high):
+    """Scale *data* from *low* and *high* to 0 and 255."""
+    return ((data - low) * (255.0 / ((high - low) or 1))).astype(np.ubyte)
+
+
+def create_volume(data, block=16):
+    """
+    Return the RGBA volume of *data* with its gray values in the color
+    channels and the squared difference of neighbouring voxels as alpha. Only
+    *block* planes along the first axis are processed at a time so that no
+    temporary is as large as *data*.
+    """
+    starts = range(0, data.shape[0], block)
+
+    def gradient(start):
+        part = data[start:start + block]
+        return (part - np.roll(part, 1, axis=-1)) ** 2
+
+    ranges = [(part.min(), part.max()) for part in (gradient(start) for start in starts)]
+    gmin, gmax = min(r[0] for r in ranges), max(r[1] for r in ranges)
+    dmin, dmax = data.min(), data.max()
     volume = np.empty(data.shape + (4, ), dtype=np.ubyte)
-    volume[..., 0] = data
-    volume[..., 1] = data
-    volume[..., 2] = data
-    volume[..., 3] = gradient
+
+    for start in starts:
+        gray = to_ubyte(data[start:start + block], dmin, dmax)
+        volume[start:start + block, ..., :3] = gray[..., np.newaxis]
+        volume[start:start + block, ..., 3] = to_ubyte(gradient(start), gmin, gmax)
+
     return volume
 
-def read_tiff(filename):
+
+def volume_step(shape, budget):
+    """Return the smallest step along all axes of *shape* that fits *budget* bytes."""
+    step = 1
+
+    while np.prod([(n + step - 1) // step for n in shape], dtype=np.int64) * VOXEL_BYTES > budget:
+        step += 1
+
+    return step
+
+def read_tiff(filename, mmap=False):
+    """
+    Return the transposed image of *filename*. With *mmap*, uncompressed
+    files are memory-mapped instead of read. Copy what is kept of a mapped
+    image, touching it after the file has been truncated kills the process.
+    """
+    if mmap:
+        try:
+            return tifffile.memmap(filename, mode='r').T
+        except ValueError:
+            pass
+
     tiff = tifffile.TiffFile(filename)
     array = tiff.asarray()
     return array.T
@@ -43,7 +90,7 @@ class ProjectionViewer(QtGui.QWidget):
     valueChanged signal.
     """
 
-    def __init__(self, parent=None):
+    def __init__(self, cache_size=512 * 2**20, parent=None):
         super(ProjectionViewer, self).__init__(parent)
         image_view = pg.ImageView()
         image_view.getView().setAspectLocked(True)
@@ -59,71 +106,261 @@ class ProjectionViewer(QtGui.QWidget):
         self.setLayout(self.main_layout)
         self.filenames = None
         self.ffc_correction = False
+        self.cache_size = cache_size
+        self.projections = None
 
     def load_files(self, filenames, ffc_correction):
         """Load *filenames* for display."""
         self.filenames = filenames
         self.ffc_correction = ffc_correction
 
-        proj, flat, dark, theta = dx.read_aps_32id(filenames, proj=(0, 1))
+        if self.projections is not None:
+            self.projections.close()
+
+        self.projections = cache.ProjectionCache(str(filenames), max_bytes=self.cache_size)
 
         #self.slider.setRange(0, len(theta) - 1)
-        self.slider.setRange(0, util.get_dx_dims(str(filenames), 'data')[0] - 1)
+        self.slider.setRange(0, util.describe(filenames).shape('data')[0] - 1)
         self.slider.setSliderPosition(0)
         self.update_image()
 
     def update_image(self):
         """Update the currently display image."""
-        if self.filenames:
+        if self.projections is not None:
             pos = self.slider.value()
-            proj, flat, dark, theta = dx.read_aps_32id(self.filenames, proj=(pos, pos+1))
-            if self.ffc_correction:
-                image = proj[0,:,:].astype(np.float)/flat[0,:,:].astype(np.float)
+            proj = self.projections.get(pos)
+            if self.ffc_correction and self.projections.flat is not None:
+                image = proj.astype(np.float)/self.projections.flat.astype(np.float)
             else:
-                image = proj[0,:,:].astype(np.float)
+                image = proj.astype(np.float)
             self.image_item.setImage(image)
 
 class SliceViewer(QtGui.QWidget):
     """
-    Present a sequence of files that can be browsed with a slider.
+    Present a sequence of files or a stack of images that can be browsed with
+    a slider. Files and lazily read stacks go through a cache.SliceCache of
+    *cache_size* bytes that prefetches ahead of the slider. While the slider
+    is dragged, slices not in the cache are shown from a stack of thumbnails
+    of at most *thumbnail_size* bytes, unless it is None.
 
     To get the currently selected position connect to the *slider* attribute's
     valueChanged signal.
     """
 
-    def __init__(self, filenames, parent=None):
+    def __init__(self, filenames, cache_size=512 * 2**20, thumbnail_size=64 * 2**20, parent=None):
         super(SliceViewer, self).__init__(parent)
         image_view = pg.ImageView()
         image_view.getView().setAspectLocked(True)
         self.image_item = image_view.getImageItem()
+        self.images = None
+        self.labels = None
+        self.slices = None
+        self.cache_size = cache_size
+        self.thumbnail_size = thumbnail_size
 
         self.slider = QtGui.QSlider(QtCore.Qt.Horizontal)
         self.slider.valueChanged.connect(self.update_image)
+        self.slider.sliderReleased.connect(self.update_image)
+        self.label = QtGui.QLabel()
 
         self.main_layout = QtGui.QVBoxLayout(self)
         self.main_layout.addWidget(image_view)
         self.main_layout.addWidget(self.slider)
+        self.main_layout.addWidget(self.label)
         self.setLayout(self.main_layout)
         self.load_files(filenames)
 
     def load_files(self, filenames):
         """Load *filenames* for display."""
         self.filenames = filenames
+        self.images = None
+        self.labels = None
+        # Cached slices must not map files a reconstruction may rewrite.
+        self.open_slices(lambda index: np.array(read_tiff(self.filenames[index], mmap=True)), len(filenames))
         self.slider.setRange(0, len(self.filenames) - 1)
         self.slider.setSliderPosition(0)
         self.update_image()
 
+    def set_stack(self, images, labels=None):
+        """
+        Display the first axis of *images*, an array or a lazily read
+        volume, with a text from *labels* for each.
+        """
+        self.filenames = []
+        self.labels = labels
+
+        if isinstance(images, np.ndarray):
+            self.images = images
+            self.open_slices(None, 0)
+        else:
+            self.images = None
+            # Transposed like the TIFs of read_tiff.
+            self.open_slices(lambda index: np.asarray(images[index]).T, len(images))
+
+        self.slider.setRange(0, len(images) - 1)
+        self.slider.setSliderPosition(0)
+        self.update_image()
+
+    def open_slices(self, read, length):
+        """Replace the slice cache with one for *length* images given by *read*."""
+        if self.slices is not None:
+            self.slices.close()
+            self.slices = None
+
+        if length:
+            self.slices = cache.SliceCache(read, length, max_bytes=self.cache_size,
+                                           thumbnail_bytes=self.thumbnail_size)
+
     def update_image(self):
         """Update the currently display image."""
-        if self.filenames:
-            pos = self.slider.value()
-            image = read_tiff(self.filenames[pos])
+        pos = self.slider.value()
+
+        if self.images is not None:
+            image = self.images[pos].T
             self.image_item.setImage(image)
+            self.image_item.setRect(QtCore.QRectF(0, 0, image.shape[0], image.shape[1]))
+        elif self.slices is not None:
+            thumbnail = None
+
+            if self.slider.isSliderDown() and pos not in self.slices:
+                thumbnail = self.slices.thumbnail(pos)
+
+            if thumbnail is not None:
+                step = self.slices.thumbnail_step
+                self.image_item.setImage(thumbnail)
+                self.image_item.setRect(QtCore.QRectF(0, 0, thumbnail.shape[0] * step,
+                                                      thumbnail.shape[1] * step))
+            else:
+                image = self.slices.get(pos)
+                self.image_item.setImage(image)
+                self.image_item.setRect(QtCore.QRectF(0, 0, image.shape[0], image.shape[1]))
+
+        self.label.setText(self.labels[pos] if self.labels else '')
+
+    def closeEvent(self, event):
+        self.open_slices(None, 0)
+        super(SliceViewer, self).closeEvent(event)
+
+
+class Reslicer(object):
+    """
+    Build planes across *source*, a list of TIF files or a lazily read array
+    of slices, from one row or column of each slice. Slices are read in a
+    pool of threads, memory-mapping uncompressed files, and the planes are
+    kept in an LRU cache of *max_bytes*.
+    """
+
+    def __init__(self, source, max_bytes=256 * 2**20):
+        self.source = source
+        self.cache = cache.LRUCache(max_bytes)
+        self.pool = ThreadPool(parallel.available_cores())
+
+    def __len__(self):
+        return len(self.source)
+
+    @property
+    def shape(self):
+        """Shape of the volume with the slices along the first axis."""
+        if isinstance(self.source, (list, tuple)):
+            return (len(self.source), ) + read_tiff(self.source[0], mmap=True).T.shape
+
+        return tuple(self.source.shape)
+
+    def _line(self, z, axis, index):
+        if isinstance(self.source, (list, tuple)):
+            image = read_tiff(self.source[z], mmap=True).T
+            return np.array(image[index] if axis == 1 else image[:, index])
+
+        return np.asarray(self.source[z, index] if axis == 1 else self.source[z, :, index])
+
+    def plane(self, axis, index):
+        """
+        Return the plane through row *index* if *axis* is 1 (XZ) or through
+        column *index* if *axis* is 2 (YZ), one slice per row.
+        """
+        plane = self.cache.get((axis, index))
+
+        if plane is None:
+            plane = np.array(self.pool.map(lambda z: self._line(z, axis, index), range(len(self))))
+            self.cache.put((axis, index), plane)
+
+        return plane
+
+    def close(self):
+        self.pool.close()
+
+
+class OrthoViewer(QtGui.QWidget):
+    """
+    Present the XZ and YZ planes of a slice stack through the row and column
+    selected with the *row_slider* and *column_slider* attributes.
+    """
+
+    def __init__(self, cache_size=256 * 2**20, parent=None):
+        super(OrthoViewer, self).__init__(parent)
+        self.cache_size = cache_size
+        self.reslicer = None
+        self.main_layout = QtGui.QVBoxLayout(self)
+        self.image_items = []
+        self.sliders = []
+
+        for name in ('XZ', 'YZ'):
+            image_view = pg.ImageView()
+            image_view.getView().setAspectLocked(True)
+            self.image_items.append(image_view.getImageItem())
+            slider = QtGui.QSlider(QtCore.Qt.Horizontal)
+            slider.setRange(0, 0)
+            slider.sliderReleased.connect(self.update_images)
+            slider.valueChanged.connect(self.on_slider_changed)
+            self.sliders.append(slider)
+            self.main_layout.addWidget(QtGui.QLabel(name))
+            self.main_layout.addWidget(image_view)
+            self.main_layout.addWidget(slider)
+
+        self.row_slider, self.column_slider = self.sliders
+        self.setLayout(self.main_layout)
+
+    def set_source(self, source):
+        """Reslice *source*, a list of TIF files or a lazily read array of slices."""
+        self.close_reslicer()
+        self.reslicer = Reslicer(source, max_bytes=self.cache_size)
+        depth, height, width = self.reslicer.shape
+
+        for slider, size in zip(self.sliders, (height, width)):
+            slider.blockSignals(True)
+            slider.setRange(0, size - 1)
+            slider.setSliderPosition(size // 2)
+            slider.blockSignals(False)
+
+        self.update_images()
+
+    def on_slider_changed(self):
+        # Reading a plane takes a while, only follow the slider once it is released.
+        if not self.sender() or not self.sender().isSliderDown():
+            self.update_images()
+
+    def update_images(self):
+        """Show the planes at the current slider positions."""
+        if self.reslicer is None:
+            return
+
+        for axis, (item, slider) in enumerate(zip(self.image_items, self.sliders), 1):
+            item.setImage(self.reslicer.plane(axis, slider.value()).T)
+
+    def close_reslicer(self):
+        if self.reslicer is not None:
+            self.reslicer.close()
+            self.reslicer = None
+
+    def closeEvent(self, event):
+        self.close_reslicer()
+        super(OrthoViewer, self).closeEvent(event)
 
 
 class OverlapViewer(QtGui.QWidget):
     """
     Presents two images by subtracting the flipped second from the first.
+    While the slider is dragged, a binned preview is shown.
 
     To get the current deviation connect to the *slider* attribute's
     valueChanged signal.
@@ -137,24 +374,28 @@ class OverlapViewer(QtGui.QWidget):
         self.slider = QtGui.QSlider(QtCore.Qt.Horizontal)
         self.slider.setRange(0, 0)
         self.slider.valueChanged.connect(self.update_image)
+        self.slider.sliderReleased.connect(self.update_image)
 
         self.main_layout = QtGui.QVBoxLayout()
         self.main_layout.addWidget(image_view)
         self.main_layout.addWidget(self.slider)
         self.setLayout(self.main_layout)
-        self.first, self.second = (None, None)
+        self.renderer = None
+        self.levels = None
 
     def set_images(self, first, second):
         """Set *first* and *second* image."""
-        self.first = remove_extrema(first.T)
-        self.second = remove_extrema(np.flipud(second.T))
+        first = remove_extrema(first.T)
+        second = remove_extrema(np.flipud(second.T))
 
-        if self.first.shape != self.second.shape:
+        if first.shape != second.shape:
             LOG.warn("Shape {} of {} is different to {} of {}".
-                     format(self.first.shape, self.first, self.second.shape, self.second))
+                     format(first.shape, first, second.shape, second))
 
-        self.slider.setRange(0, self.first.shape[0])
-        self.slider.setSliderPosition(self.first.shape[0] / 2)
+        self.renderer = ufot.process.OverlapRenderer(first, second)
+        self.levels = None
+        self.slider.setRange(0, first.shape[0])
+        self.slider.setSliderPosition(first.shape[0] // 2)
         self.update_image()
 
     def set_position(self, position):
@@ -163,17 +404,106 @@ class OverlapViewer(QtGui.QWidget):
 
     def update_image(self):
         """Update the current subtraction."""
-        if self.first is None or self.second is None:
+        if self.renderer is None:
             LOG.warn("No images set yet")
-        else:
-            pos = self.slider.value()
-            moved = np.roll(self.second, self.second.shape[0] / 2 - pos, axis=0)
-            self.image_item.setImage(moved - self.first)
+            return
+
+        shift = self.renderer.shape[0] // 2 - self.slider.value()
+        image = self.renderer.render(shift, preview=self.slider.isSliderDown())
+
+        # Keep the levels of the first full image instead of computing them
+        # for every position.
+        if self.levels is None:
+            self.levels = (float(image.min()), float(image.max()))
+
+        self.image_item.setImage(image, autoLevels=False, levels=self.levels)
+        self.image_item.setRect(QtCore.QRectF(0, 0, self.renderer.shape[0], self.renderer.shape[1]))
+
+
+class VolumeLoader(QtCore.QThread):
+    """
+    Read *source*, a list of TIF files or a lazily read array of slices,
+    every *step*-th voxel along each axis and emit *loaded* with the RGBA
+    volume and the step. A step of None picks the smallest one fitting
+    *budget* bytes. The volume is first loaded *levels* - 1 times at a
+    coarser step, halving it each time, so that something is shown early.
+    Slices are read in a pool of threads.
+    """
+    loaded = QtCore.pyqtSignal(object, int)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, source, step=None, budget=512 * 2**20, levels=3, parent=None):
+        super(VolumeLoader, self).__init__(parent)
+        self.source = source
+        self.step = step
+        self.budget = budget
+        self.levels = levels
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Stop before the next level."""
+        self.cancel_event.set()
+
+    def read_slice(self, index, step):
+        """Return slice *index* of the source with the axes of read_tiff."""
+        if isinstance(self.source, (list, tuple)):
+            return read_tiff(self.source[index], mmap=True)[::step, ::step]
+
+        return np.asarray(self.source[index, ::step, ::step]).T
+
+    def shape(self):
+        if isinstance(self.source, (list, tuple)):
+            return (len(self.source), ) + read_tiff(self.source[0]).shape
+
+        return tuple(self.source.shape)
+
+    def read(self, step):
+        """Return the float volume of every *step*-th voxel, slices along the last axis."""
+        indices = range(0, self.shape()[0], step)
+        first = self.read_slice(indices[0], step)
+        data = np.empty(first.shape + (len(indices), ), dtype=np.float32)
+        pool = ThreadPool(parallel.available_cores())
+
+        try:
+            for i, image in enumerate(pool.imap(lambda index: self.read_slice(index, step), indices)):
+                if self.cancel_event.is_set():
+                    return None
+
+                data[:, :, i] = image
+        finally:
+            pool.close()
+
+        return data
+
+    def run(self):
+        try:
+            shape = self.shape()
+            step = self.step or volume_step(shape, self.budget)
+            steps = [step * 2 ** level for level in reversed(range(self.levels))]
+            LOG.info('Loading volume of %s with steps %s', shape, steps)
+
+            for level_step in steps:
+                # Skip coarse levels too small to show anything.
+                if level_step != step and min(shape) // level_step < 16:
+                    continue
+
+                data = self.read(level_step)
+
+                if data is None:
+                    return
+
+                self.loaded.emit(create_volume(data), level_step)
+        except Exception as e:
+            self.failed.emit(str(e))
 
 
 class VolumeViewer(QtGui.QWidget):
+    """
+    Render a reconstructed volume, loaded in the background by a
+    VolumeLoader within *budget* bytes unless a fixed *step* is given.
+    """
 
-    def __init__(self, step=1, density=1, parent=None):
+    def __init__(self, step=None, density=1, budget=512 * 2**20, parent=None):
         super(VolumeViewer, self).__init__(parent)
         self.volume_view = gl.GLViewWidget()
         self.main_layout = QtGui.QVBoxLayout()
@@ -181,23 +511,95 @@ class VolumeViewer(QtGui.QWidget):
         self.setLayout(self.main_layout)
         self.step = step
         self.density = density
+        self.budget = budget
+        self.loader = None
+        self.volume_item = None
 
     def load_data(self, filenames):
         """Load *filenames* for display."""
-        filenames = filenames[::self.step]
-        num = len(filenames)
-        first = read_tiff(filenames[0])[::self.step, ::self.step]
-        width, height = first.shape
-        data = np.empty((width, height, num), dtype=np.float32)
-        data[:,:,0] = first
-
-        for i, filename in enumerate(filenames[1:]):
-            data[:, :, i + 1] = read_tiff(filename)[::self.step, ::self.step]
+        self.load(list(filenames))
+
+    def set_volume(self, volume):
+        """Display the slices along the first axis of the array *volume*."""
+        self.load(volume)
+
+    def load(self, source):
+        """Start loading *source*, replacing a previous load."""
+        self.stop()
+        self.loader = VolumeLoader(source, step=self.step, budget=self.budget)
+        self.loader.loaded.connect(self.show_volume)
+        self.loader.failed.connect(lambda message: LOG.warn('Loading volume failed: %s', message))
+        self.loader.start()
+
+    def stop(self):
+        """Cancel a running load."""
+        if self.loader is not None and self.loader.isRunning():
+            self.loader.cancel()
+            self.loader.wait()
+
+    def show_volume(self, volume, step):
+        """Show the RGBA *volume* loaded at *step*, replacing the previous one."""
+        if self.sender() is not None and self.sender() is not self.loader:
+            return
 
-        volume = create_volume(data)
         dx, dy, dz, _ = volume.shape
 
-        volume_item = gl.GLVolumeItem(volume, sliceDensity=self.density)
-        volume_item.translate(-dx / 2, -dy / 2, -dz / 2)
-        volume_item.scale(0.05, 0.05, 0.05, local=False)
-        self.volume_view.addItem(volume_item)
+        if self.volume_item is not None:
+            self.volume_view.removeItem(self.volume_item)
+
+        self.volume_item = gl.GLVolumeItem(volume, sliceDensity=self.density)
+        self.volume_item.translate(-dx / 2, -dy / 2, -dz / 2)
+        self.volume_item.scale(0.05 * step, 0.05 * step, 0.05 * step, local=False)
+        self.volume_view.addItem(self.volume_item)
+
+    def closeEvent(self, event):
+        self.stop()
+        super(VolumeViewer, self).closeEvent(event)
+
+
+class QueueViewer(QtGui.QWidget):
+    """
+    Present the jobs of a batch queue and their state.
+
+    To drive the queue connect to the clicked signals of the *add_button*,
+    *start_button* and *stop_button* attributes.
+    """
+
+    def __init__(self, parent=None):
+        super(QueueViewer, self).__init__(parent)
+        self.table = QtGui.QTableWidget(0, 2)
+        self.table.setHorizontalHeaderLabels(['File', 'State'])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+
+        self.concurrency = QtGui.QSpinBox()
+        self.concurrency.setRange(1, 64)
+        self.add_button = QtGui.QPushButton('Add files')
+        self.start_button = QtGui.QPushButton('Start')
+        self.stop_button = QtGui.QPushButton('Stop')
+        self.stop_button.setEnabled(False)
+
+        button_layout = QtGui.QHBoxLayout()
+        button_layout.addWidget(QtGui.QLabel('Concurrent jobs'))
+        button_layout.addWidget(self.concurrency)
+        button_layout.addStretch()
+        button_layout.addWidget(self.add_button)
+        button_layout.addWidget(self.start_button)
+        button_layout.addWidget(self.stop_button)
+
+        self.main_layout = QtGui.QVBoxLayout(self)
+        self.main_layout.addWidget(self.table)
+        self.main_layout.addLayout(button_layout)
+        self.setLayout(self.main_layout)
+
+    def set_jobs(self, jobs):
+        """Show the file name and state of each of *jobs*."""
+        self.table.setRowCount(len(jobs))
+
+        for row, job in enumerate(jobs):
+            self.table.setItem(row, 0, QtGui.QTableWidgetItem(job['file']))
+            self.table.setItem(row, 1, QtGui.QTableWidgetItem(job['state']))
+
+    def set_running(self, running):
+        self.start_button.setEnabled(not running)
+        self.stop_button.setEnabled(running)